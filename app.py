@@ -1,17 +1,196 @@
 import streamlit as st
 import requests
+from requests.adapters import HTTPAdapter
+import urllib3
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, Future, wait, FIRST_COMPLETED
+from concurrent.futures import CancelledError, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
 import json
+import contextvars
+import logging
+from contextlib import contextmanager, nullcontext
+import gzip
 import base64
+import csv
+import hashlib
+import io
+import multiprocessing
+import pickle
+import socket
+import sqlite3
+import sys
+import threading
+import weakref
+from collections import OrderedDict, deque
 import os
 import time
-import matplotlib.pyplot as plt
+import math
 import random
+import re
+from streamlit.runtime.scriptrunner import get_script_run_ctx
 from streamlit_option_menu import option_menu
+import graph_worker
+import shared_state
 
 # ---------------------------
 # Configuration
 # ---------------------------
-API_BASE = "https://dev.razonica.in"
+API_BASE = os.environ.get("RAZONICA_API_BASE", "https://dev.razonica.in")
+
+# Per-endpoint timeouts in seconds; anything not listed uses DEFAULT_TIMEOUT
+DEFAULT_TIMEOUT = 30
+ENDPOINT_TIMEOUTS = {
+    "/login": 30,
+    "/register": 30,
+    "/list_uploaded_files": 15,
+    "/get_user_files": 15,
+    "/delete_upload": 30,
+    "/reprocess_upload": 30,
+    "/delete_uploads": 120,
+    "/reprocess_uploads": 120,
+    "/run_aicore": 180,
+    "/run_web_agent": 180,
+    "/generate_streamlit_graph": 180,
+}
+# Retry policy for idempotent GETs (POSTs are never retried)
+GET_RETRIES = 3
+RETRY_BACKOFF = 0.5
+RETRY_STATUSES = (502, 503, 504)
+
+# Admission control toward the backend, shared by all sessions of this server:
+# at most CONCURRENCY_LIMITS[class] requests of an endpoint class are in flight
+# at once, so slow agent calls cannot starve the cheap listing calls. Waiting
+# requests are admitted round-robin across sessions.
+ENDPOINT_CLASSES = {
+    "/run_aicore": "agent",
+    "/run_web_agent": "agent",
+    "/generate_streamlit_graph": "agent",
+}
+CONCURRENCY_LIMITS = {"agent": 8, "default": 16}
+
+# Each question has QUESTION_DEADLINE seconds in total. An agent call's timeout
+# is its DEADLINE_SHARES fraction of the time left when it starts (calls not
+# listed get all of it), never more than its ENDPOINT_TIMEOUTS entry, and is
+# sent to the backend in DEADLINE_HEADER as milliseconds.
+QUESTION_DEADLINE = float(os.environ.get("RAZONICA_QUESTION_DEADLINE", 240))
+DEADLINE_SHARES = {"/run_aicore": 0.6}
+DEADLINE_HEADER = "X-Request-Deadline-Ms"
+
+# Hedged requests, for endpoints that are safe to send twice (comma-separated
+# paths in RAZONICA_HEDGED_ENDPOINTS, e.g. "/run_aicore,/generate_streamlit_graph").
+# A non-streamed call still unanswered after the endpoint's HEDGE_QUANTILE latency
+# (from its last LATENCY_WINDOW responses, once there are HEDGE_MIN_SAMPLES) is sent
+# again if a backend slot is free, and the first good response wins.
+HEDGED_ENDPOINTS = {p for p in os.environ.get("RAZONICA_HEDGED_ENDPOINTS", "").split(",") if p}
+HEDGE_QUANTILE = 0.95
+HEDGE_MIN_SAMPLES = 20
+HEDGE_MIN_DELAY = 0.5
+LATENCY_WINDOW = 500
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 180)
+
+# Chat rendering: the latest CHAT_WINDOW_TURNS (or more, up to a page boundary)
+# turns are always rendered; older ones are grouped into collapsed pages
+CHAT_WINDOW_TURNS = 10
+CHAT_PAGE_TURNS = 20
+
+# Dropzone uploads: files are sent in chunks of UPLOAD_CHUNK_MB, several chunks
+# at a time, retried with backoff and resumed from the chunks the backend holds
+UPLOAD_CHUNK_MB = 8
+UPLOAD_PARALLEL_CHUNKS = 3
+UPLOAD_PARALLEL_FILES = 2
+UPLOAD_CHUNK_RETRIES = 6
+# Chunked uploads need a backend that takes Dropzone's dz* chunk fields on /upload
+# and answers /upload_status. "auto" chunks only when /upload_status answers, "on"
+# and "off" force it; without chunking each file is sent whole in one POST.
+UPLOAD_CHUNKING = os.environ.get("RAZONICA_UPLOAD_CHUNKING", "auto")
+
+# File listings are cached per token for this many seconds
+FILE_LIST_TTL = 15
+# While any upload is pending/processing the file tables poll on their own,
+# backing off from FILE_POLL_MIN_SECONDS to FILE_POLL_MAX_SECONDS while nothing changes
+FILE_POLL_MIN_SECONDS = 2
+FILE_POLL_MAX_SECONDS = 30
+
+# Batch actions in the Status tab. Each action has a per-file endpoint taking
+# {"upload_id": ...}. Its batch endpoint ({"upload_ids": [...]} answered with
+# {"results": [{"upload_id", "success", "message"}]}) is used while the backend
+# offers it; otherwise FILE_BATCH_PARALLEL per-file requests run at a time.
+FILE_ACTION_ENDPOINTS = {"delete": "/delete_upload", "reprocess": "/reprocess_upload"}
+FILE_BATCH_ENDPOINTS = {"delete": "/delete_uploads", "reprocess": "/reprocess_uploads"}
+FILE_BATCH_PARALLEL = 8
+
+# History sent to the agents: at most HISTORY_MAX_TURNS recent turns and
+# HISTORY_MAX_BYTES of JSON, with GraphAgent code replaced by a short reference.
+HISTORY_MAX_TURNS = 6
+HISTORY_MAX_BYTES = 48 * 1024
+# JSON bodies at least this large are sent gzip-compressed (None disables it;
+# only enable when the backend accepts Content-Encoding: gzip)
+GZIP_MIN_BYTES = int(os.environ["RAZONICA_GZIP_MIN_BYTES"]) if os.environ.get("RAZONICA_GZIP_MIN_BYTES") else None
+
+# Opt-in answer cache for the agent endpoints, shared by all sessions through a
+# local SQLite file. Enabled when RAZONICA_RESPONSE_CACHE points at a file path.
+RESPONSE_CACHE_PATH = os.environ.get("RAZONICA_RESPONSE_CACHE")
+RESPONSE_CACHE_TTL = 24 * 3600
+RESPONSE_CACHE_MAX_BYTES = 256 * 1024 * 1024
+
+# Typing-effect pacing: frames of N characters at a fixed frame rate, with a
+# total time cap per message. Longer messages are rendered in a single delta.
+ANIMATION_FPS = 30
+ANIMATION_CHARS_PER_FRAME = 12
+ANIMATION_MAX_SECONDS = 1.5
+ANIMATION_INSTANT_CHARS = 2000
+
+# Rendered GraphAgent charts are cached by a hash of their code plus this salt;
+# bump GRAPH_CACHE_VERSION whenever rendering changes.
+GRAPH_CACHE_VERSION = "1"
+GRAPH_CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+# Interactive chart mode: GraphAgent is asked for a declarative Vega-Lite spec
+# (matplotlib code it returns instead is converted to one where possible) and
+# the chart is drawn by the browser with st.vega_lite_chart. Line, area and
+# point series longer than CHART_MAX_POINTS are downsampled with
+# CHART_DOWNSAMPLE: "lttb" (largest-triangle-three-buckets) or "minmax".
+CHART_MAX_POINTS = int(os.environ.get("RAZONICA_CHART_MAX_POINTS", 2000))
+CHART_DOWNSAMPLE = os.environ.get("RAZONICA_CHART_DOWNSAMPLE", "lttb")
+
+# Tables in agent replies (markdown pipe tables, ```csv/```tsv blocks and runs of
+# at least TABLE_MIN_ROWS delimited lines) are parsed once per reply into
+# Arrow-backed DataFrames and shown with st.dataframe, TABLE_PAGE_ROWS rows at a time.
+TABLE_MIN_ROWS = 5
+TABLE_PAGE_ROWS = 100
+TABLE_CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+# GraphAgent code runs in a pool of worker processes with these limits
+GRAPH_WORKERS = max(2, min(8, os.cpu_count() or 2))
+GRAPH_CPU_SECONDS = 20
+GRAPH_WALL_SECONDS = 45
+GRAPH_MAX_MEMORY_MB = 1024
+# A chart waits this long for a free worker before it is reported as busy
+GRAPH_QUEUE_SECONDS = 60
+# Workers are replaced after this many snippets, returning whatever memory
+# matplotlib and imported modules accumulated in them
+GRAPH_TASKS_PER_WORKER = 100
+
+# Conversations are persisted per user in SQLite; each session keeps only the
+# latest CONVERSATION_MEMORY_TURNS turns in memory
+CONVERSATION_DB_PATH = os.environ.get(
+    "RAZONICA_CONVERSATION_DB",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".razonica", "conversations.sqlite")
+)
+CONVERSATION_MEMORY_TURNS = 30
+# Each rerun estimates the size of the session's state. Above
+# SESSION_MEMORY_BUDGET_MB the oldest in-memory turns outside the chat window
+# leave memory, then the chart payloads of the remaining turns; both stay in
+# the store and are reloaded when rendered.
+SESSION_MEMORY_BUDGET_MB = float(os.environ.get("RAZONICA_SESSION_MEMORY_MB", 16))
+
+# Performance instrumentation (timers, counters, per-rerun log lines and the
+# sidebar panel) is off unless RAZONICA_PERF=1. With RAZONICA_PERF_EXPORT_DIR
+# set, metrics.json and metrics.prom are rewritten there every PERF_EXPORT_INTERVAL seconds.
+PERF_ENABLED = os.environ.get("RAZONICA_PERF") == "1"
+PERF_EXPORT_DIR = os.environ.get("RAZONICA_PERF_EXPORT_DIR")
+PERF_EXPORT_INTERVAL = 15
 
 # ---------------------------
 # Session State Initialization
@@ -19,52 +198,1530 @@ API_BASE = "https://dev.razonica.in"
 if "token" not in st.session_state:
     st.session_state["token"] = None
 if "conversations" not in st.session_state:
+    # In-memory window of the latest turns; the full conversation lives in the ConversationStore.
     # Each item: {"user_message": str, "agent_replies": [{"agent": "AiCore"/"WebAgent"/"GraphAgent", "content": str, "type": "text"/"graph"}]}
+    # Turns marked "evicted" had their chart payloads dropped by enforce_memory_budget.
     st.session_state["conversations"] = []
+    # Absolute index of conversations[0], and the total number of turns
+    st.session_state["conversation_offset"] = 0
+    st.session_state["turn_count"] = 0
 if "rendered_count" not in st.session_state:
     st.session_state["rendered_count"] = 0
+if "new_reply_turns" not in st.session_state:
+    # Turns whose replies came in from a background job and have not been rendered yet
+    st.session_state["new_reply_turns"] = set()
+if "agent_jobs" not in st.session_state:
+    # Running background agent jobs, by the absolute index of the turn they answer
+    st.session_state["agent_jobs"] = {}
+
+# ---------------------------
+# Performance instrumentation
+# ---------------------------
+class PerfRegistry:
+    """Timers ({count, sum, max} seconds), counters and gauges, keyed by (metric, label)."""
+
+    def __init__(self):
+        self.timers = {}
+        self.counters = {}
+        self.gauges = {}
+        self._lock = threading.Lock()
+
+    def observe(self, metric, label, seconds):
+        with self._lock:
+            timer = self.timers.get((metric, label))
+            if timer is None:
+                timer = self.timers[(metric, label)] = {"count": 0, "sum": 0.0, "max": 0.0}
+            timer["count"] += 1
+            timer["sum"] += seconds
+            timer["max"] = max(timer["max"], seconds)
+
+    def add(self, metric, label, value):
+        with self._lock:
+            self.counters[(metric, label)] = self.counters.get((metric, label), 0) + value
+
+    def set(self, metric, label, value):
+        with self._lock:
+            self.gauges[(metric, label)] = value
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "timers": [dict(metric=m, label=l, **t) for (m, l), t in sorted(self.timers.items())],
+                "counters": [{"metric": m, "label": l, "value": v} for (m, l), v in sorted(self.counters.items())],
+                "gauges": [{"metric": m, "label": l, "value": v} for (m, l), v in sorted(self.gauges.items())],
+            }
+
+    def to_prometheus(self):
+        def labels(label):
+            escaped = label.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+            return f'{{label="{escaped}"}}' if label else ""
+        snap = self.snapshot()
+        lines = []
+        for metric in sorted({t["metric"] for t in snap["timers"]}):
+            lines.append(f"# TYPE razonica_{metric}_seconds summary")
+            for t in snap["timers"]:
+                if t["metric"] == metric:
+                    lines.append(f"razonica_{metric}_seconds_count{labels(t['label'])} {t['count']}")
+                    lines.append(f"razonica_{metric}_seconds_sum{labels(t['label'])} {t['sum']:.6f}")
+            lines.append(f"# TYPE razonica_{metric}_seconds_max gauge")
+            for t in snap["timers"]:
+                if t["metric"] == metric:
+                    lines.append(f"razonica_{metric}_seconds_max{labels(t['label'])} {t['max']:.6f}")
+        for metric in sorted({c["metric"] for c in snap["counters"]}):
+            lines.append(f"# TYPE razonica_{metric}_total counter")
+            for c in snap["counters"]:
+                if c["metric"] == metric:
+                    lines.append(f"razonica_{metric}_total{labels(c['label'])} {c['value']}")
+        for metric in sorted({g["metric"] for g in snap["gauges"]}):
+            lines.append(f"# TYPE razonica_{metric} gauge")
+            for g in snap["gauges"]:
+                if g["metric"] == metric:
+                    lines.append(f"razonica_{metric}{labels(g['label'])} {g['value']}")
+        return "\n".join(lines) + "\n"
+
+@st.cache_resource
+def get_perf_registry():
+    """Process-wide registry, aggregated across sessions."""
+    return PerfRegistry()
+
+def _perf_targets():
+    return (get_perf_registry(), shared_state.session_perf.get(), shared_state.rerun_perf.get())
+
+def perf_observe(metric, seconds, label=""):
+    if PERF_ENABLED:
+        for registry in _perf_targets():
+            if registry is not None:
+                registry.observe(metric, label, seconds)
+
+def perf_count(metric, value=1, label=""):
+    if PERF_ENABLED:
+        for registry in _perf_targets():
+            if registry is not None:
+                registry.add(metric, label, value)
+
+def perf_gauge(metric, value, label="", session=False):
+    """Sets a gauge on the process registry, or on the session's with session=True."""
+    if PERF_ENABLED:
+        registry = shared_state.session_perf.get() if session else get_perf_registry()
+        if registry is not None:
+            registry.set(metric, label, value)
+
+@contextmanager
+def _perf_timer(metric, label):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        perf_observe(metric, time.perf_counter() - start, label)
+
+def perf_timed(metric, label=""):
+    """Context manager timing a block; a shared no-op when instrumentation is off."""
+    return _perf_timer(metric, label) if PERF_ENABLED else nullcontext()
+
+@st.cache_resource
+def get_perf_logger():
+    logger = logging.getLogger("razonica.perf")
+    if not logger.handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        logger.addHandler(handler)
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+    return logger
+
+def write_metrics_files(directory, registry):
+    os.makedirs(directory, exist_ok=True)
+    for name, data in (("metrics.json", json.dumps(registry.snapshot(), indent=1)),
+                       ("metrics.prom", registry.to_prometheus() + get_client().latency_to_prometheus())):
+        tmp_path = os.path.join(directory, name + ".tmp")
+        with open(tmp_path, "w") as f:
+            f.write(data)
+        os.replace(tmp_path, os.path.join(directory, name))
+
+@contextmanager
+def rerun_trace():
+    """Times one script run and emits a structured log line for it."""
+    if not PERF_ENABLED:
+        yield
+        return
+    session = st.session_state.setdefault("perf", PerfRegistry())
+    rerun = PerfRegistry()
+    session_token = shared_state.session_perf.set(session)
+    rerun_token = shared_state.rerun_perf.set(rerun)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        perf_observe("rerun", elapsed)
+        shared_state.rerun_perf.reset(rerun_token)
+        shared_state.session_perf.reset(session_token)
+        snap = rerun.snapshot()
+        ctx = get_script_run_ctx()
+        get_perf_logger().info(json.dumps({
+            "event": "rerun",
+            "session": ctx.session_id if ctx else None,
+            "seconds": round(elapsed, 4),
+            "timers": {f"{t['metric']}{'|' + t['label'] if t['label'] else ''}": round(t["sum"], 4)
+                       for t in snap["timers"]},
+            "counters": {f"{c['metric']}{'|' + c['label'] if c['label'] else ''}": c["value"]
+                         for c in snap["counters"]},
+            "state_bytes": session.gauges.get(("session_state_bytes", "")),
+            "rss_bytes": process_rss(),
+        }))
+        now = time.monotonic()
+        if PERF_EXPORT_DIR and now - shared_state.last_metrics_export[0] >= PERF_EXPORT_INTERVAL:
+            shared_state.last_metrics_export[0] = now
+            write_metrics_files(PERF_EXPORT_DIR, get_perf_registry())
+
+def performance_panel():
+    """Sidebar panel with this session's and the whole process's metrics."""
+    with st.expander("Performance"):
+        scope = st.radio("Scope", ["This session", "All sessions"], horizontal=True, key="perf_scope")
+        registry = get_perf_registry() if scope == "All sessions" else st.session_state.get("perf", PerfRegistry())
+        snap = registry.snapshot()
+        st.dataframe(
+            [{"timer": t["metric"], "label": t["label"], "count": t["count"],
+              "avg ms": round(1000 * t["sum"] / t["count"], 1), "max ms": round(1000 * t["max"], 1)}
+             for t in snap["timers"]],
+            hide_index=True
+        )
+        st.dataframe(
+            [{"counter": c["metric"], "label": c["label"], "value": c["value"]} for c in snap["counters"]],
+            hide_index=True
+        )
+        st.dataframe(
+            [{"gauge": g["metric"], "label": g["label"], "value": g["value"]} for g in snap["gauges"]],
+            hide_index=True
+        )
+        st.caption("Backend latency (all sessions)")
+        st.dataframe(get_client().latency_snapshot(), hide_index=True)
+        payload_stats = get_client().payload_stats.get("/run_aicore")
+        if payload_stats:
+            st.caption(
+                f"/run_aicore payload (all sessions): "
+                f"{payload_stats['bytes'] / payload_stats['requests'] / 1024:.1f} KB per request "
+                f"({payload_stats['wire_bytes'] / payload_stats['requests'] / 1024:.1f} KB on the wire)"
+            )
+        chart_stats = get_chart_cache().stats()
+        st.caption(
+            f"Chart cache (all sessions): {chart_stats['hits']} hits, {chart_stats['misses']} misses, "
+            f"{chart_stats['entries']} charts ({chart_stats['bytes'] / 1024:.0f} KB)"
+        )
+        st.download_button("metrics.json", json.dumps(snap, indent=1), file_name="metrics.json",
+                           mime="application/json")
+        st.download_button("metrics.prom", registry.to_prometheus(), file_name="metrics.prom",
+                           mime="text/plain")
+
+# ---------------------------
+# Backend client (pooled connections shared across reruns and sessions)
+# ---------------------------
+def current_session_id():
+    session = shared_state.request_session.get()
+    if session is None:
+        ctx = get_script_run_ctx(suppress_warning=True)
+        session = ctx.session_id if ctx else None
+    return session
+
+class FairLimiter:
+    """
+    Admits at most `limit` holders at once. Waiters are queued per session
+    and admitted round-robin across sessions, first-come first-served within
+    a session, so one session's burst cannot push others to the back.
+    """
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.active = 0
+        self._cond = threading.Condition()
+        self._queues = OrderedDict()  # session -> deque of waiting tickets
+        self._admitted = set()
+
+    def _admit(self):
+        while self.active < self.limit and self._queues:
+            session, tickets = next(iter(self._queues.items()))
+            self._admitted.add(tickets.popleft())
+            self.active += 1
+            if tickets:
+                self._queues.move_to_end(session)
+            else:
+                del self._queues[session]
+        self._cond.notify_all()
+
+    def acquire(self, session, timeout=None):
+        """Blocks until admitted; raises requests.Timeout after `timeout` seconds in the queue."""
+        with self._cond:
+            if self.active < self.limit and not self._queues:
+                self.active += 1
+                return
+            ticket = object()
+            self._queues.setdefault(session, deque()).append(ticket)
+            admitted = self._cond.wait_for(lambda: ticket in self._admitted, timeout)
+            if admitted:
+                self._admitted.discard(ticket)
+                return
+            tickets = self._queues[session]
+            tickets.remove(ticket)
+            if not tickets:
+                del self._queues[session]
+            raise requests.Timeout("Timed out waiting for a free backend slot")
+
+    def release(self):
+        with self._cond:
+            self.active -= 1
+            self._admit()
+
+    def position(self, session):
+        """Sessions admitted before this session's next queued request (0 = next), or None."""
+        with self._cond:
+            for i, queued in enumerate(self._queues):
+                if queued == session:
+                    return i
+            return None
+
+class _JobTrackingConnection:
+    """Registers itself with the AgentJob it sends a request for."""
+
+    def request(self, *args, **kwargs):
+        job = shared_state.current_job.get()
+        self.agent_job = job
+        if job is not None:
+            job.track(self)
+        return super().request(*args, **kwargs)
+
+class _TrackedHTTPConnection(_JobTrackingConnection, HTTPConnection):
+    pass
+
+class _TrackedHTTPSConnection(_JobTrackingConnection, HTTPSConnection):
+    pass
+
+class _TrackedHTTPConnectionPool(urllib3.HTTPConnectionPool):
+    ConnectionCls = _TrackedHTTPConnection
+
+class _TrackedHTTPSConnectionPool(urllib3.HTTPSConnectionPool):
+    ConnectionCls = _TrackedHTTPSConnection
+
+class JobAwareAdapter(HTTPAdapter):
+    """HTTPAdapter whose connections can be aborted by cancelling their AgentJob."""
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _TrackedHTTPConnectionPool,
+            "https": _TrackedHTTPSConnectionPool,
+        }
+
+class Deadline:
+    """Overall time budget of one question, shared by its agent calls."""
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.expires = time.monotonic() + seconds
+
+    def remaining(self):
+        return self.expires - time.monotonic()
+
+    def timeout(self, path, cap):
+        """This call's share of the remaining budget, at most `cap`; raises requests.Timeout once spent."""
+        remaining = self.remaining()
+        if remaining <= 0:
+            raise requests.Timeout(f"Question deadline of {self.seconds:g} s exceeded")
+        return min(cap, remaining * DEADLINE_SHARES.get(path, 1.0))
+
+class LatencyHistogram:
+    """Response times of one endpoint: cumulative LATENCY_BUCKETS counts plus a window of recent samples."""
+
+    def __init__(self):
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)  # the last bucket is +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.recent = deque(maxlen=LATENCY_WINDOW)
+        self._lock = threading.Lock()
+
+    def observe(self, seconds):
+        with self._lock:
+            i = next((i for i, bound in enumerate(LATENCY_BUCKETS) if seconds <= bound), len(LATENCY_BUCKETS))
+            self.buckets[i] += 1
+            self.count += 1
+            self.sum += seconds
+            self.recent.append(seconds)
+
+    def quantile(self, q):
+        """q-quantile of the recent samples, or None before HEDGE_MIN_SAMPLES were seen."""
+        with self._lock:
+            if len(self.recent) < HEDGE_MIN_SAMPLES:
+                return None
+            ordered = sorted(self.recent)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def snapshot(self):
+        with self._lock:
+            return {"count": self.count, "sum": self.sum, "buckets": list(self.buckets)}
+
+def _close_response(future):
+    if future.exception() is None:
+        future.result().close()
+
+# BackendClient.post takes a `json=` keyword like requests does, which shadows the module
+_json_dumps = json.dumps
+
+class BackendClient:
+    """Thin wrapper over a pooled requests.Session for all Razonica API calls."""
+
+    def __init__(self, base_url, pool_size=32):
+        self.base_url = base_url.rstrip("/")
+        self.session = requests.Session()
+        adapter = JobAwareAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        # Per-endpoint request body sizes: {path: {"requests", "bytes", "wire_bytes"}}
+        self.payload_stats = {}
+        self._stats_lock = threading.Lock()
+        self.limiters = {name: FairLimiter(limit) for name, limit in CONCURRENCY_LIMITS.items()}
+        # Identical GETs in flight, shared by every session: {key: Future}
+        self._inflight = {}
+        self._inflight_lock = threading.Lock()
+        # Response times of completed non-streamed requests: {path: LatencyHistogram}
+        self.latency = {}
+        self._hedge_pool = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix="hedge")
+
+    def _record_payload(self, path, raw_bytes, wire_bytes):
+        with self._stats_lock:
+            stats = self.payload_stats.setdefault(path, {"requests": 0, "bytes": 0, "wire_bytes": 0})
+            stats["requests"] += 1
+            stats["bytes"] += raw_bytes
+            stats["wire_bytes"] += wire_bytes
+
+    def _headers(self, token=None, extra=None):
+        headers = {}
+        if token:
+            headers["Authorization"] = "Bearer " + token
+        if extra:
+            headers.update(extra)
+        return headers
+
+    def _timeout(self, path, timeout):
+        if timeout is not None:
+            return timeout
+        return ENDPOINT_TIMEOUTS.get(path, DEFAULT_TIMEOUT)
+
+    def _limiter(self, path):
+        return self.limiters[ENDPOINT_CLASSES.get(path, "default")]
+
+    def _histogram(self, path):
+        histogram = self.latency.get(path)
+        if histogram is None:
+            histogram = self.latency.setdefault(path, LatencyHistogram())
+        return histogram
+
+    def hedge_delay(self, path):
+        """Seconds after which a hedged call to `path` is sent again, or None while there is too little history."""
+        p = self._histogram(path).quantile(HEDGE_QUANTILE)
+        return None if p is None else max(HEDGE_MIN_DELAY, p)
+
+    @contextmanager
+    def _admitted(self, path, timeout):
+        limiter = self._limiter(path)
+        with perf_timed("backend_queue", ENDPOINT_CLASSES.get(path, "default")):
+            limiter.acquire(current_session_id(), self._timeout(path, timeout))
+        try:
+            yield
+        finally:
+            limiter.release()
+
+    def latency_snapshot(self):
+        """Per-endpoint latency summary for the performance panel."""
+        def ms(seconds):
+            return None if seconds is None else round(1000 * seconds, 1)
+        rows = []
+        for path, histogram in sorted(self.latency.items()):
+            snap = histogram.snapshot()
+            rows.append({
+                "endpoint": path,
+                "count": snap["count"],
+                "avg ms": ms(snap["sum"] / snap["count"]) if snap["count"] else None,
+                "p50 ms": ms(histogram.quantile(0.5)),
+                "p95 ms": ms(histogram.quantile(0.95)),
+                "hedge after ms": ms(self.hedge_delay(path)) if path in HEDGED_ENDPOINTS else None,
+            })
+        return rows
+
+    def latency_to_prometheus(self):
+        lines = ["# TYPE razonica_backend_latency_seconds histogram"]
+        for path, histogram in sorted(self.latency.items()):
+            snap = histogram.snapshot()
+            cumulative = 0
+            for bound, count in zip(LATENCY_BUCKETS + ("+Inf",), snap["buckets"]):
+                cumulative += count
+                lines.append(f'razonica_backend_latency_seconds_bucket{{path="{path}",le="{bound}"}} {cumulative}')
+            lines.append(f'razonica_backend_latency_seconds_sum{{path="{path}"}} {snap["sum"]:.6f}')
+            lines.append(f'razonica_backend_latency_seconds_count{{path="{path}"}} {snap["count"]}')
+        return "\n".join(lines) + "\n"
+
+    def queue_position(self, session):
+        """How many sessions are ahead of `session` in the busiest queue it waits in, or None."""
+        positions = [p for p in (l.position(session) for l in self.limiters.values()) if p is not None]
+        return max(positions) if positions else None
+
+    def get(self, path, token=None, headers=None, timeout=None, **kwargs):
+        """
+        GET with retries and full-jitter exponential backoff. A GET identical
+        to one already in flight (from any session) waits for and shares that
+        request's response instead of sending its own.
+        """
+        if kwargs.get("stream"):
+            return self._get(path, token, headers, timeout, **kwargs)
+        key = (path, token, tuple(sorted((headers or {}).items())), repr(sorted(kwargs.items())))
+        with self._inflight_lock:
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = self._inflight[key] = Future()
+        if not leader:
+            perf_count("coalesced_get", label=path)
+            return future.result()
+        try:
+            resp = self._get(path, token, headers, timeout, **kwargs)
+            future.set_result(resp)
+            return resp
+        except BaseException as exc:
+            future.set_exception(exc)
+            raise
+        finally:
+            with self._inflight_lock:
+                del self._inflight[key]
+
+    def _get(self, path, token=None, headers=None, timeout=None, **kwargs):
+        url = self.base_url + path
+        for attempt in range(GET_RETRIES + 1):
+            try:
+                with self._admitted(path, timeout), perf_timed("backend_request", "GET " + path):
+                    start = time.perf_counter()
+                    resp = self.session.get(
+                        url,
+                        headers=self._headers(token, headers),
+                        timeout=self._timeout(path, timeout),
+                        **kwargs
+                    )
+                    if not kwargs.get("stream"):
+                        self._histogram(path).observe(time.perf_counter() - start)
+                if resp.status_code not in RETRY_STATUSES or attempt == GET_RETRIES:
+                    return resp
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt == GET_RETRIES:
+                    raise
+            time.sleep(random.uniform(0, RETRY_BACKOFF * (2 ** attempt)))
+
+    def post(self, path, token=None, headers=None, timeout=None, json=None, **kwargs):
+        """
+        POST without retries, since the agent and delete endpoints are not
+        idempotent. JSON bodies are serialized here so their size can be
+        recorded, and gzip-compressed when at least GZIP_MIN_BYTES long.
+        Inside an agent job the timeout is cut to the question's deadline
+        (see Deadline), and calls to HEDGED_ENDPOINTS may be hedged.
+        A streamed response keeps its backend slot until it is closed.
+        """
+        headers = self._headers(token, headers)
+        if json is not None:
+            body = _json_dumps(json).encode("utf-8")
+            raw_bytes = len(body)
+            headers["Content-Type"] = "application/json"
+            if GZIP_MIN_BYTES is not None and raw_bytes >= GZIP_MIN_BYTES:
+                body = gzip.compress(body, compresslevel=5)
+                headers["Content-Encoding"] = "gzip"
+            self._record_payload(path, raw_bytes, len(body))
+            perf_count("request_bytes", len(body), label=path)
+            kwargs["data"] = body
+        timeout = self._timeout(path, timeout)
+        if path in HEDGED_ENDPOINTS and not kwargs.get("stream"):
+            return self._post_hedged(path, headers, timeout, kwargs)
+        return self._post(path, headers, timeout, kwargs)
+
+    def _post(self, path, headers, timeout, kwargs, queue=True):
+        """One POST attempt; with queue=False it fails at once when no backend slot is free."""
+        deadline = shared_state.deadline.get()
+        limiter = self._limiter(path)
+        if not queue:
+            queue_timeout = 0
+        else:
+            queue_timeout = deadline.timeout(path, timeout) if deadline is not None else timeout
+        with perf_timed("backend_queue", ENDPOINT_CLASSES.get(path, "default")):
+            limiter.acquire(current_session_id(), queue_timeout)
+        try:
+            if deadline is not None:
+                # Time spent queueing for the slot comes out of the budget
+                timeout = deadline.timeout(path, timeout)
+                headers = dict(headers, **{DEADLINE_HEADER: str(int(timeout * 1000))})
+            # For streamed responses this is the time until the headers arrive
+            with perf_timed("backend_request", "POST " + path):
+                start = time.perf_counter()
+                resp = self.session.post(
+                    self.base_url + path,
+                    headers=headers,
+                    timeout=timeout,
+                    **kwargs
+                )
+        except BaseException:
+            limiter.release()
+            raise
+        if not kwargs.get("stream"):
+            limiter.release()
+            self._histogram(path).observe(time.perf_counter() - start)
+            return resp
+        if deadline is not None:
+            # Checked between events by _post_agent, since the read timeout only bounds each read
+            resp.expires = time.monotonic() + timeout
+        close = resp.close
+        released = []
+
+        def close_and_release():
+            close()
+            if not released:
+                released.append(True)
+                limiter.release()
+
+        resp.close = close_and_release
+        return resp
+
+    def _post_hedged(self, path, headers, timeout, kwargs):
+        """
+        Sends the request and, if it is still unanswered after hedge_delay,
+        the same request again, provided a backend slot is free right away.
+        The first response that is not a server error wins.
+        """
+        delay = self.hedge_delay(path)
+        if delay is None or delay >= timeout:
+            return self._post(path, headers, timeout, kwargs)
+        # Attempts run on the hedge pool in this thread's context, so job
+        # cancellation, the deadline and admission still apply to them
+        first = self._hedge_pool.submit(contextvars.copy_context().run, self._post, path, headers, timeout, kwargs)
+        if wait([first], timeout=delay).done:
+            return first.result()
+        hedge = self._hedge_pool.submit(
+            contextvars.copy_context().run, self._post, path, headers, timeout - delay, kwargs, False
+        )
+        pending = {first, hedge}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None and future.result().status_code < 500:
+                    perf_count("hedged_request", label="hedge won" if future is hedge else "original won")
+                    for loser in pending:
+                        loser.add_done_callback(_close_response)
+                    return future.result()
+        return first.result()
+
+@st.cache_resource
+def get_client():
+    return BackendClient(API_BASE)
+
+# ---------------------------
+# Conversation history compaction
+# ---------------------------
+def compact_reply(reply):
+    """Copy of a reply fit for the backend: graph code becomes a short reference."""
+    content = reply.get("content", "")
+    if reply.get("type") == "graph" and content.strip():
+        digest = hashlib.sha256(content.encode("utf-8")).hexdigest()[:12]
+        content = f"[graph code {digest} omitted, {content.count(chr(10)) + 1} lines]"
+    elif reply.get("type") == "chart_spec":
+        digest = hashlib.sha256(content.encode("utf-8")).hexdigest()[:12]
+        content = f"[chart spec {digest} omitted, {len(content) // 1024} KB]"
+    return {"agent": reply.get("agent", "Agent"), "content": content, "type": reply.get("type", "text")}
+
+def compact_turn(turn):
+    return {
+        "user_message": turn["user_message"],
+        "agent_replies": [compact_reply(r) for r in turn["agent_replies"]],
+    }
+
+def compact_history(conversations, max_turns=HISTORY_MAX_TURNS, max_bytes=HISTORY_MAX_BYTES):
+    """
+    Returns the most recent turns of the conversation, compacted, limited to
+    max_turns turns and roughly max_bytes of JSON. The latest turn is always kept.
+    """
+    turns = [compact_turn(t) for t in conversations[-max_turns:]] if max_turns else []
+    kept = []
+    total = 0
+    for turn in reversed(turns):
+        size = len(json.dumps(turn))
+        if kept and total + size > max_bytes:
+            break
+        kept.append(turn)
+        total += size
+    kept.reverse()
+    return kept
+
+# ---------------------------
+# Agent answer cache (SQLite, shared across sessions)
+# ---------------------------
+class ResponseCache:
+    """
+    Agent response bodies stored in SQLite, keyed by request hash. Entries
+    expire after `ttl` seconds and the least recently used ones are evicted
+    once the stored bodies exceed `max_bytes`.
+    """
+
+    def __init__(self, path, ttl, max_bytes):
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        with self._connect() as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                " key TEXT PRIMARY KEY, body TEXT NOT NULL, size INTEGER NOT NULL,"
+                " created REAL NOT NULL, last_used REAL NOT NULL)"
+            )
+            db.execute("CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used)")
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=10)
+
+    def get(self, key):
+        now = time.time()
+        with self._connect() as db:
+            row = db.execute(
+                "SELECT body FROM responses WHERE key = ? AND created > ?", (key, now - self.ttl)
+            ).fetchone()
+            if row is None:
+                return None
+            db.execute("UPDATE responses SET last_used = ? WHERE key = ?", (now, key))
+        return json.loads(row[0])
+
+    def put(self, key, body):
+        now = time.time()
+        data = json.dumps(body)
+        with self._connect() as db:
+            db.execute(
+                "INSERT OR REPLACE INTO responses (key, body, size, created, last_used) VALUES (?, ?, ?, ?, ?)",
+                (key, data, len(data), now, now)
+            )
+            db.execute("DELETE FROM responses WHERE created <= ?", (now - self.ttl,))
+            total = db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+            if total > self.max_bytes:
+                for old_key, size in db.execute("SELECT key, size FROM responses ORDER BY last_used").fetchall():
+                    if total <= self.max_bytes:
+                        break
+                    db.execute("DELETE FROM responses WHERE key = ?", (old_key,))
+                    total -= size
+
+@st.cache_resource
+def get_response_cache():
+    return ResponseCache(RESPONSE_CACHE_PATH, RESPONSE_CACHE_TTL, RESPONSE_CACHE_MAX_BYTES) if RESPONSE_CACHE_PATH else None
+
+class AgentMemo:
+    """
+    Per-question handle on the answer cache. Entries are scoped to the
+    conversation owner, and `files` fingerprints the selected files (id,
+    status and content version) so re-processed uploads miss. With
+    use_cached=False the backend is always called, but the fresh answer
+    still replaces the cached one.
+    """
+
+    def __init__(self, cache, owner, files, use_cached=True):
+        self.cache = cache
+        self.owner = owner
+        self.files = files
+        self.use_cached = use_cached
+
+    def key(self, path, payload):
+        data = json.dumps(
+            {"path": path, "payload": payload, "owner": self.owner, "files": self.files}, sort_keys=True
+        )
+        return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+def selected_files_fingerprint(token, selected_files):
+    """
+    [name, id, status, version] for each selected file, from the cached
+    upload listing; None when the listing failed or lacks a selected file,
+    since the answer cache cannot tell such files apart.
+    """
+    listing = fetch_files(token, "/list_uploaded_files")
+    if listing is None:
+        return None
+    by_name = {f.get('filename'): f for f in listing}
+    fingerprint = []
+    for selected in selected_files:
+        name = selected if isinstance(selected, str) else selected.get('filename')
+        info = by_name.get(name, {})
+        if info.get('id') is None:
+            return None
+        version = info.get('sha256') or info.get('hash') or info.get('updated_at') or info.get('uploaded_at')
+        fingerprint.append([name, info.get('id'), info.get('status'), version])
+    return fingerprint
+
+# ---------------------------
+# Agent calls (dependency-aware fan-out on a shared thread pool)
+# ---------------------------
+@st.cache_resource
+def get_agent_pool():
+    return ThreadPoolExecutor(max_workers=16, thread_name_prefix="agent")
+
+def _timed_agent_task(name, fn):
+    if not PERF_ENABLED:
+        return fn
+    def timed(**kwargs):
+        with perf_timed("agent_task", name):
+            return fn(**kwargs)
+    return timed
+
+def run_agent_tasks(tasks, on_reply, on_tick=None, tick=0.05, cancel=None):
+    """
+    Runs agent tasks concurrently. `tasks` maps a name to (fn, deps); fn is
+    called with the (replies, result) of each dependency as a keyword
+    argument and must return its own (replies, result). A task starts as
+    soon as its dependencies finish, and on_reply is called on the calling
+    thread for each reply as soon as its task completes. If on_tick is
+    given it is called on the calling thread every `tick` seconds while
+    tasks are running. Once the `cancel` event is set no further tasks are
+    started; running ones are waited for.
+    """
+    pool = get_agent_pool()
+    session = current_session_id()
+    pending = dict(tasks)
+    done = {}
+    running = {}
+    while pending or running:
+        if cancel is not None and cancel.is_set():
+            pending.clear()
+        for name, (fn, deps) in list(pending.items()):
+            if all(dep in done for dep in deps):
+                # Run in a copy of this thread's context so metrics and backend
+                # admission are attributed to this session
+                context = contextvars.copy_context()
+                context.run(shared_state.request_session.set, session)
+                timed = _timed_agent_task(name, fn)
+                running[pool.submit(context.run, timed, **{dep: done[dep] for dep in deps})] = name
+                del pending[name]
+        if not running:
+            if not pending:
+                break
+            raise ValueError(f"Unsatisfiable agent dependencies: {sorted(pending)}")
+        finished, _ = wait(
+            running, timeout=tick if on_tick or cancel else None, return_when=FIRST_COMPLETED
+        )
+        if on_tick:
+            on_tick()
+        for future in finished:
+            name = running.pop(future)
+            done[name] = future.result()
+            for reply in done[name][0]:
+                on_reply(reply)
+    return done
+
+def iter_sse_events(resp):
+    """Yields the JSON payload of each `data:` event in a text/event-stream response."""
+    # SSE is always UTF-8; without a charset requests would decode text/* as ISO-8859-1
+    resp.encoding = "utf-8"
+    data_lines = []
+    for line in resp.iter_lines(decode_unicode=True):
+        if line:
+            if line.startswith(":"):
+                continue
+            field, _, value = line.partition(":")
+            if field == "data":
+                data_lines.append(value[1:] if value.startswith(" ") else value)
+            continue
+        if data_lines:
+            data = "\n".join(data_lines)
+            data_lines = []
+            if data == "[DONE]":
+                return
+            yield json.loads(data)
+
+def post_agent(client, path, token, payload, on_delta=None, memo=None, prepare=None):
+    """
+    POSTs to an agent endpoint, answering from the memo's cache when it can.
+    prepare(body), if given, is applied to every 200 body before it is
+    cached or returned.
+    Returns (status_code, body, streamed, cached).
+    """
+    key = memo.key(path, payload) if memo is not None else None
+    if memo is not None and memo.use_cached:
+        body = memo.cache.get(key)
+        if body is not None:
+            return 200, (prepare(body) if prepare else body), False, True
+    status, body, streamed = _post_agent(client, path, token, payload, on_delta)
+    if status == 200 and prepare:
+        body = prepare(body)
+    if status == 200 and memo is not None:
+        memo.cache.put(key, body)
+    return status, body, streamed, False
+
+def _post_agent(client, path, token, payload, on_delta=None):
+    """
+    When on_delta is given the backend is asked for an event stream; each
+    {"agent": ..., "delta": ...} event is passed to on_delta(agent, text) as
+    it arrives, and an optional {"body": {...}} event carries the final JSON
+    body. Backends that ignore the Accept header and answer with plain JSON
+    fall back to the non-streaming contract.
+    Returns (status_code, body, streamed).
+    """
+    if on_delta is None:
+        r = client.post(path, token=token, json=payload)
+        return r.status_code, (r.json() if r.status_code == 200 else {}), False
+
+    with client.post(
+        path, token=token, json=payload,
+        headers={"Accept": "text/event-stream, application/json"}, stream=True
+    ) as r:
+        content_type = r.headers.get("Content-Type", "")
+        if r.status_code != 200 or not content_type.startswith("text/event-stream"):
+            return r.status_code, (r.json() if r.status_code == 200 else {}), False
+        texts = {}
+        body = None
+        expires = getattr(r, "expires", None)
+        for event in iter_sse_events(r):
+            if expires is not None and time.monotonic() > expires:
+                raise requests.Timeout("Agent call ran past its share of the question deadline")
+            if "body" in event:
+                body = event["body"]
+            elif event.get("delta"):
+                agent = event.get("agent", "Agent")
+                texts[agent] = texts.get(agent, "") + event["delta"]
+                on_delta(agent, event["delta"])
+        return r.status_code, (body if body is not None else texts), True
+
+def call_aicore(client, token, query, files, history, on_delta=None, memo=None):
+    """ExcelAgent/TextAgent call. Returns (replies, aicore_result)."""
+    replies = []
+    aicore_result = {}
+    payload = {"query": query, "files": files, "history": history}
+    try:
+        status, body, streamed, cached = post_agent(client, "/run_aicore", token, payload, on_delta, memo)
+        if status == 200:
+            aicore_result = body  # e.g. {"ExcelAgent": "...", "TextAgent": "..."}
+            excel_text = aicore_result.get("ExcelAgent", "")
+            text_text = aicore_result.get("TextAgent", "")
+            if excel_text.strip():
+                replies.append({"agent": "ExcelAgent", "content": excel_text, "type": "text",
+                                "streamed": streamed, "cached": cached})
+            if text_text.strip():
+                replies.append({"agent": "TextAgent", "content": text_text, "type": "text",
+                                "streamed": streamed, "cached": cached})
+        else:
+            replies.append({"agent": "AiCore", "content": "[AiCore] Error from backend.", "type": "text"})
+    except Exception as exc:
+        replies.append({"agent": "AiCore", "content": f"[AiCore] Exception: {exc}", "type": "text"})
+    return replies, aicore_result
+
+def call_web_agent(client, token, query, history, aicore, on_delta=None, memo=None):
+    """WebAgent cross-check of the ExcelAgent answer. Returns (replies, web_data)."""
+    aicore_replies, aicore_result = aicore
+    # The current turn is sent with the AiCore replies already attached
+    turn_history = history[:-1] + [dict(history[-1], agent_replies=[compact_reply(r) for r in aicore_replies])]
+    replies = []
+    web_data = {}
+    payload = {
+        "query": query,
+        "excel_result": aicore_result.get("ExcelAgent", ""),
+        "history": turn_history
+    }
+    try:
+        status, web_data, streamed, cached = post_agent(client, "/run_web_agent", token, payload, on_delta, memo)
+        if status == 200:
+            # {"agent":"WebAgent","result":{...}}, or {"WebAgent": "..."} when only deltas were streamed
+            if "result" in web_data:
+                web_analysis = web_data["result"].get("openai_analysis", "")
+                replies.append({"agent": "WebAgent", "content": web_analysis, "type": "text",
+                                "streamed": streamed, "cached": cached})
+            elif "WebAgent" in web_data:
+                replies.append({"agent": "WebAgent", "content": web_data["WebAgent"], "type": "text",
+                                "streamed": streamed, "cached": cached})
+        else:
+            replies.append({"agent": "WebAgent", "content": "[WebAgent] Error from backend.", "type": "text"})
+    except Exception as exc:
+        replies.append({"agent": "WebAgent", "content": f"[WebAgent] Exception: {exc}", "type": "text"})
+    return replies, web_data
+
+def call_graph_agent(client, token, query, aicore, memo=None, chart_spec=False):
+    """
+    GraphAgent chart generation. With chart_spec the backend is asked for a
+    Vega-Lite spec ({"spec": {...}}); backends that answer with code anyway
+    get their figures converted to specs by the graph workers.
+    Returns (replies, graph_code).
+    """
+    _, aicore_result = aicore
+    replies = []
+    graph_code = ""
+    payload = {
+        "query": query,
+        "excel_result": aicore_result.get("ExcelAgent", "")
+    }
+    if chart_spec:
+        payload["chart_format"] = "vega-lite"
+
+    def downsampled(body):
+        # Once, as the reply arrives, so the session, the conversation store and
+        # the answer cache never hold the full-resolution data
+        if isinstance(body.get("spec"), dict):
+            return dict(body, spec=downsample_spec(body["spec"]))
+        return body
+
+    try:
+        status, body, _, cached = post_agent(
+            client, "/generate_streamlit_graph", token, payload, memo=memo, prepare=downsampled
+        )
+        if status == 200 and isinstance(body.get("spec"), dict):
+            replies.append({"agent": "GraphAgent", "content": json.dumps(body["spec"]), "type": "chart_spec",
+                            "cached": cached})
+        elif status == 200:
+            graph_code = body.get("code", "")
+            replies.append({"agent": "GraphAgent", "content": graph_code, "type": "graph", "cached": cached,
+                            "chart_spec": chart_spec})
+        else:
+            replies.append({"agent": "GraphAgent", "content": "[GraphAgent] Could not generate chart code.", "type": "text"})
+    except Exception as exc:
+        replies.append({"agent": "GraphAgent", "content": f"[GraphAgent] Exception: {exc}", "type": "text"})
+    return replies, graph_code
+
+# ---------------------------
+# Background agent jobs (the script thread only polls them)
+# ---------------------------
+@st.cache_resource
+def get_job_pool():
+    return ThreadPoolExecutor(max_workers=32, thread_name_prefix="agent-job")
+
+class AgentJob:
+    """
+    The agent calls answering one conversation turn, run on a background
+    thread so the session keeps rendering, can switch pages and can cancel
+    them. Replies are saved to the conversation store as they arrive;
+    sync_agent_jobs copies the finished turn into the session.
+    """
+
+    def __init__(self, store, owner, seq, turn):
+        self.store = store
+        self.owner = owner
+        self.seq = seq
+        self.turn = dict(turn, agent_replies=list(turn["agent_replies"]))
+        self.status = "running"  # running, done or cancelled
+        self.started = time.monotonic()
+        self.deadline = Deadline(QUESTION_DEADLINE)
+        self.streamed = {}  # agent -> text received so far
+        self._cancel = threading.Event()
+        self._connections = weakref.WeakSet()
+        self._lock = threading.Lock()
+
+    def start(self, tasks):
+        # Cached resources must be created on the script thread
+        get_agent_pool()
+        # The job thread and the agent threads it fans out to inherit this context
+        context = contextvars.copy_context()
+        context.run(shared_state.current_job.set, self)
+        context.run(shared_state.deadline.set, self.deadline)
+        context.run(shared_state.request_session.set, current_session_id())
+        get_job_pool().submit(context.run, self._run, tasks)
+
+    def _run(self, tasks):
+        try:
+            run_agent_tasks(tasks, self._on_reply, cancel=self._cancel)
+        except Exception as exc:
+            self._on_reply({"agent": "System", "content": f"[System] Exception: {exc}", "type": "text"})
+        with self._lock:
+            if self.status == "running":
+                self.status = "done"
+
+    def _on_reply(self, reply):
+        with self._lock:
+            if self._cancel.is_set():
+                return
+            self.turn["agent_replies"].append(reply)
+            self.store.update(self.owner, self.seq, self.turn)
+
+    def on_delta(self, agent, text):
+        with self._lock:
+            self.streamed[agent] = self.streamed.get(agent, "") + text
+
+    def track(self, connection):
+        """Called by a connection about to send a request for this job."""
+        if self._cancel.is_set():
+            raise ConnectionAbortedError("Agent job cancelled")
+        self._connections.add(connection)
+
+    def cancel(self, keep=True):
+        """
+        Stops the job and aborts its in-flight requests. With keep, the turn
+        keeps the replies received so far plus a note; otherwise nothing more
+        is saved for it.
+        """
+        with self._lock:
+            if self.status != "running":
+                return
+            self.status = "cancelled"
+            self._cancel.set()
+            if keep:
+                self.turn["agent_replies"].append(
+                    {"agent": "System", "content": "Cancelled before all agents answered.", "type": "text"}
+                )
+                self.store.update(self.owner, self.seq, self.turn)
+        for connection in list(self._connections):
+            if getattr(connection, "agent_job", None) is self and connection.sock is not None:
+                try:
+                    connection.sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
 
-# For demonstration (Graph placeholders), storing random data
-if "demo_graph_data" not in st.session_state:
-    st.session_state["demo_graph_data"] = [random.randint(1, 10) for _ in range(4)]
-if "generated_graph_code" not in st.session_state:
-    st.session_state["generated_graph_code"] = ""
+    def progress(self):
+        """(replies so far, {agent: streamed text} for agents still answering)."""
+        with self._lock:
+            replies = list(self.turn["agent_replies"])
+            answered = {r.get("agent") for r in replies}
+            return replies, {a: t for a, t in self.streamed.items() if a not in answered}
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self.turn, agent_replies=list(self.turn["agent_replies"]))
 
 # ---------------------------
 # Utility to animate text
 # ---------------------------
 def animate_text(full_text, placeholder):
-    """Gradually renders text character by character."""
-    typed_text = ""
-    for ch in full_text:
-        typed_text += ch
-        placeholder.markdown(typed_text)
+    """
+    Gradually renders text in frames of ANIMATION_CHARS_PER_FRAME characters
+    at ANIMATION_FPS, never taking longer than ANIMATION_MAX_SECONDS.
+    Returns the number of markdown deltas sent to the browser.
+    """
+    with perf_timed("animate_text"):
+        sent = _animate_text(full_text, placeholder)
+    perf_count("markdown_deltas", sent)
+    return sent
+
+def _animate_text(full_text, placeholder):
+    n = len(full_text)
+    if n <= ANIMATION_CHARS_PER_FRAME or n > ANIMATION_INSTANT_CHARS or ANIMATION_FPS <= 0:
+        placeholder.markdown(full_text)
+        return 1
+    max_frames = max(1, int(ANIMATION_FPS * ANIMATION_MAX_SECONDS))
+    frames = min(math.ceil(n / ANIMATION_CHARS_PER_FRAME), max_frames)
+    step = math.ceil(n / frames)
+    frame_time = 1.0 / ANIMATION_FPS
+    start = time.perf_counter()
+    sent = 0
+    for end in range(step, n + step, step):
+        placeholder.markdown(full_text[:end])
+        sent += 1
+        delay = start + sent * frame_time - time.perf_counter()
+        if end < n and delay > 0:
+            time.sleep(delay)
+    return sent
 
 # ---------------------------
-# Helper functions for login, signup, logout
+# Static assets (built once per process; only per-session values are filled in per rerun)
 # ---------------------------
-def login():
-    st.markdown(
-        """
+LOGIN_CSS = """
+<style>
+.stTextInput > div > div > input {
+    background-color: rgba(255, 255, 255, 0.1);
+    border: 1px solid rgba(255, 255, 255, 0.2);
+    padding: 12px 16px;
+    border-radius: 8px;
+    color: inherit;
+    font-size: 16px;
+    transition: all 0.3s ease;
+    width: 100%;
+}
+.stTextInput > div > div > input:focus {
+    border-color: #1a73e8;
+    box-shadow: 0 0 0 2px rgba(26,115,232,0.2);
+}
+</style>
+"""
+
+@st.cache_resource
+def sidebar_menu_styles():
+    return {
+        "container": {"padding": "0!important", "background-color": "transparent"},
+        "icon": {"color": "#ffffff", "font-size": "20px"},
+        "nav-link": {
+            "font-size": "16px",
+            "text-align": "left",
+            "margin": "2px",
+            "--hover-color": "#ff2b2b",
+            "color": "white"
+        },
+        "nav-link-selected": {"background-color": "#ff2b2b"},
+    }
+
+DROPZONE_TOKEN_MARKER = "__RAZONICA_TOKEN__"
+
+@st.cache_resource
+def dropzone_template():
+    """
+    The upload page, built once per process. Only the token differs between
+    sessions, so the page is returned split around it as (before, after).
+    """
+    html = f"""
+    <!DOCTYPE html>
+    <html lang="en">
+    <head>
         <style>
-        .stTextInput > div > div > input {
-            background-color: rgba(255, 255, 255, 0.1);
-            border: 1px solid rgba(255, 255, 255, 0.2);
-            padding: 12px 16px;
-            border-radius: 8px;
-            color: inherit;
-            font-size: 16px;
-            transition: all 0.3s ease;
-            width: 100%;
-        }
-        .stTextInput > div > div > input:focus {
-            border-color: #1a73e8;
-            box-shadow: 0 0 0 2px rgba(26,115,232,0.2);
-        }
+            :root {{
+                --primary-color: #BB86FC;
+                --background-color: #F0F2F6;
+                --text-color: #333333;
+                --font: "Source Sans Pro", sans-serif;
+            }}
+            .dropzone {{
+                border: 2px dashed var(--primary-color);
+                border-radius: 5px;
+                background: var(--background-color);
+                padding: 20px;
+                width: 100%;
+                color: var(--text-color);
+                font-family: var(--font);
+                max-height: 500px;
+                overflow-y: auto;
+            }}
+            .dropzone .dz-message {{
+                font-size: 1.2em;
+                color: var(--text-color);
+            }}
+            .dz-preview {{
+                position: relative;
+                background: var(--background-color);
+                border: 1px solid var(--primary-color);
+                border-radius: 5px;
+                padding: 10px;
+                margin-top: 10px;
+            }}
+            .delete-icon {{
+                position: absolute;
+                top: -10px;
+                right: -10px;
+                width: 24px;
+                height: 24px;
+                cursor: pointer;
+                z-index: 1000;
+                transition: transform 0.2s;
+            }}
+            .delete-icon:hover {{
+                transform: scale(1.1);
+            }}
+            ::-webkit-scrollbar {{
+                width: 8px;
+            }}
+            ::-webkit-scrollbar-track {{
+                background: var(--background-color);
+            }}
+            ::-webkit-scrollbar-thumb {{
+                background-color: var(--primary-color);
+                border-radius: 4px;
+            }}
         </style>
-        """,
-        unsafe_allow_html=True
-    )
+        <link rel="stylesheet" href="https://cdnjs.cloudflare.com/ajax/libs/dropzone/5.9.3/dropzone.min.css">
+        <script src="https://cdnjs.cloudflare.com/ajax/libs/dropzone/5.9.3/dropzone.min.js"></script>
+    </head>
+    <body>
+        <form action="{API_BASE}/upload" class="dropzone" id="fileDropzone">
+            <div class="dz-message">
+                Drag and drop files here or click to upload.
+            </div>
+        </form>
+        <script>
+            const apiBase = "{API_BASE}";
+            const jwtToken = {DROPZONE_TOKEN_MARKER};
+            const CHUNK_SIZE = {UPLOAD_CHUNK_MB * 1024 * 1024};
+            const PARALLEL_CHUNKS = {UPLOAD_PARALLEL_CHUNKS};
+            const PARALLEL_FILES = {UPLOAD_PARALLEL_FILES};
+            const CHUNK_RETRIES = {UPLOAD_CHUNK_RETRIES};
+            const CHUNKING = "{UPLOAD_CHUNKING}";
+            // Content hashes are SHA-256 over the SHA-256 digests of fixed 8 MB blocks,
+            // independent of CHUNK_SIZE so the hash of a file never changes.
+            const HASH_BLOCK = 8 * 1024 * 1024;
+            const authHeaders = {{'Authorization': 'Bearer ' + jwtToken}};
+
+            function sleep(ms) {{
+                return new Promise(resolve => setTimeout(resolve, ms));
+            }}
+
+            function toHex(buffer) {{
+                return Array.from(new Uint8Array(buffer))
+                    .map(b => b.toString(16).padStart(2, '0')).join('');
+            }}
+
+            async function contentHash(file) {{
+                if (!(window.crypto && crypto.subtle)) {{
+                    return null;
+                }}
+                const digests = [];
+                for (let offset = 0; offset < file.size; offset += HASH_BLOCK) {{
+                    const block = await file.slice(offset, offset + HASH_BLOCK).arrayBuffer();
+                    digests.push(new Uint8Array(await crypto.subtle.digest('SHA-256', block)));
+                }}
+                const joined = new Uint8Array(digests.length * 32);
+                digests.forEach((digest, i) => joined.set(digest, i * 32));
+                return toHex(await crypto.subtle.digest('SHA-256', joined));
+            }}
+
+            async function knownHashes() {{
+                try {{
+                    const response = await fetch(apiBase + '/list_uploaded_files', {{headers: authHeaders}});
+                    if (!response.ok) {{
+                        return new Set();
+                    }}
+                    const data = await response.json();
+                    return new Set((data.files || []).map(f => f.sha256 || f.hash).filter(Boolean));
+                }} catch (error) {{
+                    return new Set();
+                }}
+            }}
+
+            // Chunks already stored for this upload: asked from the backend, falling
+            // back to what this browser recorded before the connection dropped.
+            async function receivedChunks(uploadId) {{
+                try {{
+                    const response = await fetch(
+                        apiBase + '/upload_status?upload_id=' + encodeURIComponent(uploadId),
+                        {{headers: authHeaders}}
+                    );
+                    if (response.ok) {{
+                        const data = await response.json();
+                        return new Set(data.received || []);
+                    }}
+                }} catch (error) {{
+                    console.warn('Upload status unavailable:', error);
+                }}
+                return new Set(JSON.parse(localStorage.getItem('razonica-upload-' + uploadId) || '[]'));
+            }}
+
+            // Whether the backend takes chunked uploads, asked once per page
+            let chunkingPromise = null;
+            function chunkingSupported() {{
+                if (CHUNKING !== 'auto') {{
+                    return Promise.resolve(CHUNKING === 'on');
+                }}
+                chunkingPromise = chunkingPromise || fetch(
+                    apiBase + '/upload_status?upload_id=probe', {{headers: authHeaders}}
+                ).then(async response => response.ok && Array.isArray((await response.json()).received))
+                 .catch(() => false);
+                return chunkingPromise;
+            }}
+
+            function rememberChunk(uploadId, index) {{
+                const key = 'razonica-upload-' + uploadId;
+                const done = new Set(JSON.parse(localStorage.getItem(key) || '[]'));
+                done.add(index);
+                localStorage.setItem(key, JSON.stringify(Array.from(done)));
+            }}
+
+            async function sendChunk(file, uploadId, contentId, index, total) {{
+                const offset = index * CHUNK_SIZE;
+                const blob = file.slice(offset, offset + CHUNK_SIZE);
+                for (let attempt = 0; ; attempt++) {{
+                    if (file.cancelled) {{
+                        throw new Error('Upload cancelled');
+                    }}
+                    if (!navigator.onLine) {{
+                        await new Promise(resolve => window.addEventListener('online', resolve, {{once: true}}));
+                    }}
+                    const formData = new FormData();
+                    formData.append('file', blob, file.name);
+                    formData.append('dzuuid', uploadId);
+                    formData.append('dzchunkindex', index);
+                    formData.append('dztotalchunkcount', total);
+                    formData.append('dzchunksize', CHUNK_SIZE);
+                    formData.append('dzchunkbyteoffset', offset);
+                    formData.append('dztotalfilesize', file.size);
+                    if (contentId) {{
+                        formData.append('file_hash', contentId);
+                    }}
+                    try {{
+                        const response = await fetch(apiBase + '/upload', {{
+                            method: 'POST', headers: authHeaders, body: formData
+                        }});
+                        if (response.ok) {{
+                            return;
+                        }}
+                        if (response.status < 500 && response.status !== 408 && response.status !== 429) {{
+                            throw Object.assign(new Error('Upload rejected (' + response.status + ')'), {{fatal: true}});
+                        }}
+                    }} catch (error) {{
+                        if (error.fatal || attempt >= CHUNK_RETRIES) {{
+                            throw error;
+                        }}
+                    }}
+                    if (attempt >= CHUNK_RETRIES) {{
+                        throw new Error('Upload failed after ' + CHUNK_RETRIES + ' retries');
+                    }}
+                    await sleep(Math.random() * Math.min(30000, 500 * 2 ** attempt));
+                }}
+            }}
+
+            // The whole file in one POST, for backends without chunked uploads
+            function sendWhole(dz, file) {{
+                return new Promise((resolve, reject) => {{
+                    const xhr = new XMLHttpRequest();
+                    xhr.open('POST', apiBase + '/upload');
+                    xhr.setRequestHeader('Authorization', 'Bearer ' + jwtToken);
+                    xhr.timeout = 300000;
+                    xhr.upload.onprogress = event => dz.emit(
+                        'uploadprogress', file, 100 * event.loaded / event.total, event.loaded
+                    );
+                    xhr.onload = () => xhr.status < 300
+                        ? resolve()
+                        : reject(new Error('Upload rejected (' + xhr.status + ')'));
+                    xhr.onerror = xhr.ontimeout = () => reject(new Error('Upload failed'));
+                    const formData = new FormData();
+                    formData.append('file', file, file.name);
+                    xhr.send(formData);
+                }});
+            }}
+
+            async function uploadFile(dz, file, hashes) {{
+                dz.emit('processing', file);
+                const contentId = await contentHash(file);
+                if (contentId && hashes.has(contentId)) {{
+                    file.status = Dropzone.SUCCESS;
+                    file.previewElement.querySelector('.dz-filename').insertAdjacentText('beforeend', ' (already uploaded, skipped)');
+                    dz.emit('success', file, {{skipped: true}});
+                    dz.emit('complete', file);
+                    return;
+                }}
+                if (!(await chunkingSupported())) {{
+                    try {{
+                        await sendWhole(dz, file);
+                        if (contentId) {{
+                            hashes.add(contentId);
+                        }}
+                        file.status = Dropzone.SUCCESS;
+                        dz.emit('success', file, {{}});
+                    }} catch (error) {{
+                        file.status = Dropzone.ERROR;
+                        dz.emit('error', file, error.message);
+                    }}
+                    dz.emit('complete', file);
+                    return;
+                }}
+                const uploadId = contentId || [file.name, file.size, file.lastModified].join('-');
+                const total = Math.max(1, Math.ceil(file.size / CHUNK_SIZE));
+                const done = await receivedChunks(uploadId);
+                const pending = [];
+                for (let i = 0; i < total; i++) {{
+                    if (!done.has(i)) {{
+                        pending.push(i);
+                    }}
+                }}
+                let completed = total - pending.length;
+                const report = () => dz.emit(
+                    'uploadprogress', file, 100 * completed / total, Math.min(file.size, completed * CHUNK_SIZE)
+                );
+                report();
+                async function worker() {{
+                    while (pending.length) {{
+                        const index = pending.shift();
+                        await sendChunk(file, uploadId, contentId, index, total);
+                        rememberChunk(uploadId, index);
+                        completed++;
+                        report();
+                    }}
+                }}
+                try {{
+                    await Promise.all(Array.from({{length: Math.min(PARALLEL_CHUNKS, total)}}, worker));
+                    localStorage.removeItem('razonica-upload-' + uploadId);
+                    if (contentId) {{
+                        hashes.add(contentId);
+                    }}
+                    file.status = Dropzone.SUCCESS;
+                    dz.emit('success', file, {{}});
+                }} catch (error) {{
+                    pending.length = 0;
+                    file.status = Dropzone.ERROR;
+                    dz.emit('error', file, error.message + ' - drop the file again to resume');
+                }}
+                dz.emit('complete', file);
+            }}
+
+            Dropzone.options.fileDropzone = {{
+                paramName: "file",
+                maxFilesize: 1024,
+                uploadMultiple: false,
+                clickable: true,
+                // Uploads are driven by uploadFile() above: deduplicated, and chunked and
+                // resumable when the backend supports it
+                autoProcessQueue: false,
+                init: function() {{
+                    const dz = this;
+                    const queue = [];
+                    let active = 0;
+                    let hashesPromise = null;
+                    function pump() {{
+                        while (active < PARALLEL_FILES && queue.length) {{
+                            const file = queue.shift();
+                            active++;
+                            hashesPromise = hashesPromise || knownHashes();
+                            // "addedfile" fires before Dropzone validates the file
+                            // (maxFilesize, acceptedFiles); by the time the hashes are
+                            // in, rejected files have accepted === false and their
+                            // error has already been shown
+                            hashesPromise
+                                .then(hashes => file.accepted ? uploadFile(dz, file, hashes) : null)
+                                .finally(() => {{
+                                    active--;
+                                    if (!active && !queue.length) {{
+                                        hashesPromise = null;
+                                    }}
+                                    pump();
+                                }});
+                        }}
+                    }}
+                    this.on("addedfile", function(file) {{
+                        queue.push(file);
+                        pump();
+                        let deleteIcon = document.createElement("img");
+                        deleteIcon.src = "https://cdn2.iconfinder.com/data/icons/user-interface-presicon-line/64/cross-512.png";
+                        deleteIcon.className = "delete-icon";
+                        file.previewElement.appendChild(deleteIcon);
+                        deleteIcon.addEventListener("click", function(e) {{
+                            e.preventDefault();
+                            e.stopPropagation();
+                            file.cancelled = true;
+                            this.removeFile(file);
+                            fetch('{API_BASE}/delete', {{
+                                method: 'POST',
+                                headers: {{
+                                    'Content-Type': 'application/json',
+                                    'Authorization': 'Bearer ' + jwtToken
+                                }},
+                                body: JSON.stringify({{ filename: file.name }})
+                            }})
+                            .then(response => {{
+                                if (response.ok) {{
+                                    return response.json();
+                                }} else {{
+                                    throw new Error('Failed to delete file');
+                                }}
+                            }})
+                            .then(data => {{
+                                if (data.success) {{
+                                    console.log('File deleted successfully');
+                                }} else {{
+                                    console.error('Error deleting file:', data.message || 'Unknown error');
+                                }}
+                            }})
+                            .catch(error => {{
+                                console.error('Error:', error);
+                            }});
+                        }}.bind(this));
+                    }});
+                }}
+            }};
+        </script>
+    </body>
+    </html>
+    """
+    return tuple(html.split(DROPZONE_TOKEN_MARKER))
+
+def dropzone_html(token):
+    before, after = dropzone_template()
+    return before + json.dumps(token) + after
+
+# ---------------------------
+# Helper functions for login, signup, logout
+# ---------------------------
+def login():
+    st.markdown(LOGIN_CSS, unsafe_allow_html=True)
     col1, col2, col3 = st.columns([1, 2, 1])
     with col2:
         username = st.text_input("📧 Email or Username", key='login_username', placeholder="Enter your email or username")
@@ -74,12 +1731,12 @@ def login():
             if username and password:
                 with st.spinner("Authenticating..."):
                     data = {'username': username, 'password': password}
-                    resp = requests.post(f"{API_BASE}/login", json=data)
+                    resp = get_client().post("/login", json=data)
                     if resp.status_code == 200:
                         st.success("Login successful! Redirecting...")
                         st.session_state['token'] = resp.json()['token']
-                        st.session_state["conversations"] = []
-                        st.session_state["rendered_count"] = 0
+                        st.session_state['username'] = username
+                        load_conversation()
                         st.rerun()
                     else:
                         st.error("Invalid credentials. Please try again.")
@@ -103,7 +1760,7 @@ def signup():
                     return
                 with st.spinner("Creating your account..."):
                     data = {'username': username, 'password': password}
-                    resp = requests.post(f"{API_BASE}/register", json=data)
+                    resp = get_client().post("/register", json=data)
                     if resp.status_code == 201:
                         st.success("Account created successfully! Please login.")
                     else:
@@ -112,23 +1769,244 @@ def signup():
                 st.warning("Please fill in all fields")
 
 def logout():
+    if st.session_state['token']:
+        get_file_list_cache().invalidate(st.session_state['token'])
+    cancel_agent_jobs(keep=True)
     st.session_state['token'] = None
+    st.session_state['username'] = None
+    st.session_state["conversation_owner"] = None
     st.session_state["conversations"] = []
+    st.session_state["conversation_offset"] = 0
+    st.session_state["turn_count"] = 0
     st.session_state["rendered_count"] = 0
+    st.session_state["new_reply_turns"] = set()
     st.success("Logged out")
     st.rerun()
 
+# ---------------------------
+# File listings (per-token TTL cache)
+# ---------------------------
+class FileListCache:
+    """
+    Caches file-listing responses per (token, endpoint) for `ttl` seconds so
+    sibling tabs and the query multiselect share one backend round-trip.
+    Entries keep the response's validators (ETag / Last-Modified) so a
+    refetch can be a conditional request.
+    """
+    NOT_MODIFIED = object()
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def peek(self, token, path):
+        with self._lock:
+            entry = self._entries.get((token, path))
+        return entry[1] if entry else None
+
+    def get(self, token, path, fetch, force=False):
+        """
+        fetch(validators) returns (files, validators), NOT_MODIFIED, or None
+        on failure.
+        """
+        key = (token, path)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry and not force and now - entry[0] < self.ttl:
+            return entry[1]
+        result = fetch(entry[2] if entry else {})
+        if result is None:
+            return None
+        if result is self.NOT_MODIFIED:
+            files, validators = entry[1], entry[2]
+        else:
+            files, validators = result
+        with self._lock:
+            self._entries = {k: v for k, v in self._entries.items() if now - v[0] < self.ttl}
+            self._entries[key] = (now, files, validators)
+        return files
+
+    def invalidate(self, token):
+        with self._lock:
+            self._entries = {k: v for k, v in self._entries.items() if k[0] != token}
+
+@st.cache_resource
+def get_file_list_cache():
+    return FileListCache(FILE_LIST_TTL)
+
+def fetch_files(token, path, force=False):
+    """The 'files' list from a listing endpoint, or None if the request failed."""
+    cache = get_file_list_cache()
+
+    def fetch(validators):
+        headers = {}
+        if validators.get("etag"):
+            headers["If-None-Match"] = validators["etag"]
+        if validators.get("last_modified"):
+            headers["If-Modified-Since"] = validators["last_modified"]
+        response = get_client().get(path, token=token, headers=headers)
+        if response.status_code == 304 and validators:
+            # The sentinel of the cached instance: the class is redefined on every rerun
+            return cache.NOT_MODIFIED
+        if response.status_code != 200:
+            return None
+        validators = {
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+        }
+        return response.json().get('files', []), validators
+    return cache.get(token, path, fetch, force=force)
+
+def poll_uploaded_files(token, force=False):
+    """
+    The /list_uploaded_files listing for the file tables. When a poll is due
+    the listing is revalidated against the backend; the poll interval doubles
+    after each poll that finds no change and resets when something changes.
+    """
+    poll = st.session_state.setdefault(
+        "file_poll", {"interval": FILE_POLL_MIN_SECONDS, "next_at": 0.0}
+    )
+    now = time.monotonic()
+    due = force or now >= poll["next_at"]
+    before = get_file_list_cache().peek(token, "/list_uploaded_files")
+    files = fetch_files(token, "/list_uploaded_files", force=due)
+    if due and files is not None:
+        if files == before:
+            poll["interval"] = min(poll["interval"] * 2, FILE_POLL_MAX_SECONDS)
+        else:
+            poll["interval"] = FILE_POLL_MIN_SECONDS
+        poll["next_at"] = now + poll["interval"]
+    return files
+
+def update_file_polling(files_data):
+    """
+    Keeps polling on only while some upload is still pending/processing.
+    Switching needs a full rerun, since run_every is fixed per fragment run.
+    """
+    polling = files_data is not None and any(
+        f.get('status') not in ('completed', 'failed') for f in files_data
+    )
+    if polling != st.session_state.get("files_polling", True):
+        st.session_state["files_polling"] = polling
+        st.rerun()
+
+def file_poll_interval():
+    return FILE_POLL_MIN_SECONDS if st.session_state.get("files_polling", True) else None
+
+def request_file_refresh():
+    st.session_state["file_refresh_pending"] = True
+
+def file_refresh_requested():
+    """
+    True once after either Refresh button was clicked: the first file table
+    rendered afterwards refetches the listing, and the other one reads the
+    refreshed listing from the cache instead of fetching it again.
+    """
+    return st.session_state.pop("file_refresh_pending", False)
+
+# ---------------------------
+# Batch file actions (Status tab)
+# ---------------------------
+FILE_ACTION_LABELS = {"delete": "Deleted", "reprocess": "Reprocessing", "query": "Selected for queries"}
+
+def response_error(response):
+    try:
+        return response.json().get('message', 'Unknown error')
+    except Exception:
+        return response.text or 'Unknown error'
+
+@st.cache_resource
+def get_file_action_pool():
+    return ThreadPoolExecutor(max_workers=FILE_BATCH_PARALLEL, thread_name_prefix="file-action")
+
+@st.cache_resource
+def get_missing_batch_endpoints():
+    """Batch endpoints the backend answered 404/405 for; they are not tried again."""
+    return set()
+
+def _file_action_request(client, token, path, upload_id):
+    try:
+        response = client.post(path, token=token, json={"upload_id": upload_id})
+    except requests.RequestException as exc:
+        return False, str(exc)
+    return (True, "") if response.status_code == 200 else (False, response_error(response))
+
+def _batch_file_action(client, token, path, upload_ids):
+    """(success, message) per upload from one batch request, or None when the backend has no such endpoint."""
+    try:
+        response = client.post(path, token=token, json={"upload_ids": upload_ids})
+    except requests.RequestException as exc:
+        return [(False, str(exc))] * len(upload_ids)
+    if response.status_code in (404, 405):
+        return None
+    if response.status_code != 200:
+        return [(False, response_error(response))] * len(upload_ids)
+    by_id = {r.get("upload_id"): r for r in response.json().get("results", [])}
+    return [
+        (bool(by_id[i].get("success")), by_id[i].get("message", "")) if i in by_id
+        else (False, "No result from backend")
+        for i in upload_ids
+    ]
+
+def _parallel_file_action(client, token, path, upload_ids):
+    """(success, message) per upload, FILE_BATCH_PARALLEL requests at a time."""
+    pool = get_file_action_pool()
+    session = current_session_id()
+    futures = []
+    for upload_id in upload_ids:
+        # Attributed to this session for backend admission, like agent calls
+        context = contextvars.copy_context()
+        context.run(shared_state.request_session.set, session)
+        futures.append(pool.submit(context.run, _file_action_request, client, token, path, upload_id))
+    return [future.result() for future in futures]
+
+def run_file_action(action, token, files):
+    """
+    Applies `action` ("delete", "reprocess" or "query") to `files`, a list
+    of upload records, and returns one result row per file.
+    """
+    if action == "query":
+        # Picked up by the Data Insights file selection on its next render
+        ready = [f for f in files if f['status'] == 'completed']
+        st.session_state["query_files_pending"] = [f['filename'] for f in ready]
+        outcomes = [(True, "") if f['status'] == 'completed' else (False, "Not processed yet") for f in files]
+    else:
+        client = get_client()
+        upload_ids = [f['id'] for f in files]
+        batch_path = FILE_BATCH_ENDPOINTS.get(action)
+        missing = get_missing_batch_endpoints()
+        outcomes = None
+        if batch_path and batch_path not in missing and len(upload_ids) > 1:
+            outcomes = _batch_file_action(client, token, batch_path, upload_ids)
+            if outcomes is None:
+                missing.add(batch_path)
+        if outcomes is None:
+            outcomes = _parallel_file_action(client, token, FILE_ACTION_ENDPOINTS[action], upload_ids)
+        if any(ok for ok, _ in outcomes):
+            get_file_list_cache().invalidate(token)
+    return [
+        {"file": f['filename'], "action": action,
+         "result": f"✅ {FILE_ACTION_LABELS[action]}" if ok else f"❌ {message or 'Failed'}"}
+        for f, (ok, message) in zip(files, outcomes)
+    ]
+
+def select_status_files(upload_ids):
+    st.session_state["status_selection"] = upload_ids
+
 # ---------------------------
 # Display File Management
 # ---------------------------
 def display_files():
     st.subheader("Uploaded Files")
-    headers = {'Authorization': 'Bearer ' + st.session_state['token']}
-    response = requests.get(f"{API_BASE}/list_uploaded_files", headers=headers)
-    if response.status_code == 200:
-        files_data = response.json().get('files', [])
-        if st.button("Refresh", key="refresh_files"):
-            st.rerun()
+    st.fragment(run_every=file_poll_interval())(uploaded_files_table)()
+
+def uploaded_files_table():
+    st.button("Refresh", key="refresh_files", on_click=request_file_refresh)
+    files_data = poll_uploaded_files(st.session_state['token'], force=file_refresh_requested())
+    update_file_polling(files_data)
+    if files_data is not None:
         if files_data:
             unique_files = {}
             for file_info in files_data:
@@ -154,109 +2032,1023 @@ def display_files():
 
 def display_status():
     st.subheader("Status of Uploaded Files")
-    headers = {'Authorization': 'Bearer ' + st.session_state['token']}
-    response = requests.get(f"{API_BASE}/list_uploaded_files", headers=headers)
-    if response.status_code == 200:
-        files_data = response.json().get('files', [])
-        if st.button("Refresh", key="refresh_status"):
-            st.rerun()
+    st.fragment(run_every=file_poll_interval())(file_status_table)()
+
+def file_status_table():
+    """
+    File statuses with multi-select batch actions. An action runs over all
+    selected files at once, its results are shown in one table and the app
+    reruns once at the end.
+    """
+    st.button("Refresh", key="refresh_status", on_click=request_file_refresh)
+    files_data = poll_uploaded_files(st.session_state['token'], force=file_refresh_requested())
+    update_file_polling(files_data)
+    if files_data is not None:
         if files_data:
-            for file_info in files_data:
-                upload_id = file_info['id']
-                filename = file_info['filename']
-                status = file_info['status']
-                col1, col2, col3 = st.columns([6, 2, 2])
-                col1.write(filename)
-                col2.write(status)
-                if col3.button("Delete", key=f"delete_{upload_id}"):
-                    data = {'upload_id': upload_id}
-                    headers2 = {
-                        'Authorization': 'Bearer ' + st.session_state['token'],
-                        'Content-Type': 'application/json'
-                    }
-                    delete_response = requests.post(f"{API_BASE}/delete_upload", headers=headers2, json=data)
-                    if delete_response.status_code == 200:
-                        st.success(f"Deleted {filename}")
-                        st.rerun()
-                    else:
-                        try:
-                            error_message = delete_response.json().get('message', 'Unknown error')
-                        except Exception:
-                            error_message = delete_response.text or 'Unknown error'
-                        st.error(f"Failed to delete {filename}: {error_message}")
+            if st.session_state.pop("status_selection_reset", False):
+                st.session_state.pop("status_selection", None)
+            by_id = {f['id']: f for f in files_data}
+            st.dataframe(
+                [{"file": f['filename'], "status": f['status']} for f in files_data],
+                hide_index=True
+            )
+            selected = st.multiselect(
+                "Selected files", list(by_id), key="status_selection",
+                format_func=lambda i: f"{by_id[i]['filename']} ({by_id[i]['status']})"
+            )
+            cols = st.columns(5)
+            cols[0].button("Select all", on_click=select_status_files, args=(list(by_id),))
+            cols[1].button("Select failed", on_click=select_status_files,
+                           args=([i for i, f in by_id.items() if f['status'] == 'failed'],))
+            actions = {
+                "delete": cols[2].button("Delete", disabled=not selected),
+                "reprocess": cols[3].button("Reprocess", disabled=not selected),
+                "query": cols[4].button("Use in queries", disabled=not selected),
+            }
+            action = next((name for name, clicked in actions.items() if clicked), None)
+            if action:
+                with st.spinner(f"Applying to {len(selected)} files..."):
+                    results = run_file_action(action, st.session_state['token'], [by_id[i] for i in selected])
+                st.session_state["file_action_results"] = results
+                st.session_state["status_selection_reset"] = True
+                st.rerun()
+            results = st.session_state.get("file_action_results")
+            if results:
+                succeeded = sum(r["result"].startswith("✅") for r in results)
+                st.caption(f"Last action: {succeeded} of {len(results)} succeeded")
+                st.dataframe(results, hide_index=True)
+                if st.button("Clear results"):
+                    del st.session_state["file_action_results"]
+                    st.rerun(scope="fragment")
         else:
             st.write("No files uploaded yet.")
     else:
         st.error("Failed to fetch files.")
 
 # ---------------------------
-# Render Chat (with partial typing & graphs)
+# Conversation store (SQLite; sessions keep a recent window in memory)
 # ---------------------------
-def render_chat():
+class ConversationStore:
+    """Conversation turns per owner, stored as JSON rows numbered 0..n-1."""
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self._connect() as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS turns ("
+                " owner TEXT NOT NULL, seq INTEGER NOT NULL, turn TEXT NOT NULL,"
+                " PRIMARY KEY (owner, seq))"
+            )
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=10)
+
+    def count(self, owner):
+        with self._connect() as db:
+            return db.execute(
+                "SELECT COALESCE(MAX(seq) + 1, 0) FROM turns WHERE owner = ?", (owner,)
+            ).fetchone()[0]
+
+    def load(self, owner, start, end):
+        with self._connect() as db:
+            rows = db.execute(
+                "SELECT turn FROM turns WHERE owner = ? AND seq >= ? AND seq < ? ORDER BY seq",
+                (owner, start, end)
+            ).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def append(self, owner, turn):
+        """Stores turn after the owner's existing ones and returns its seq."""
+        return self.import_turns(owner, [turn])
+
+    def update(self, owner, seq, turn):
+        with self._connect() as db:
+            db.execute(
+                "UPDATE turns SET turn = ? WHERE owner = ? AND seq = ?",
+                (json.dumps(turn), owner, seq)
+            )
+
+    def clear(self, owner):
+        with self._connect() as db:
+            db.execute("DELETE FROM turns WHERE owner = ?", (owner,))
+
+    def export(self, owner):
+        return self.load(owner, 0, self.count(owner))
+
+    def import_turns(self, owner, turns):
+        """Appends turns after the owner's existing ones, in one transaction; returns the first seq."""
+        with self._connect() as db:
+            # Take the write lock before reading MAX(seq), so sessions of the same
+            # owner appending at once (two tabs) get distinct seqs
+            db.execute("BEGIN IMMEDIATE")
+            start = db.execute(
+                "SELECT COALESCE(MAX(seq) + 1, 0) FROM turns WHERE owner = ?", (owner,)
+            ).fetchone()[0]
+            db.executemany(
+                "INSERT INTO turns (owner, seq, turn) VALUES (?, ?, ?)",
+                [(owner, start + i, json.dumps(turn)) for i, turn in enumerate(turns)]
+            )
+        return start
+
+@st.cache_resource
+def get_conversation_store():
+    return ConversationStore(CONVERSATION_DB_PATH)
+
+def conversation_owner():
+    """Turns belong to the logged-in username, so they survive new sessions and restarts."""
+    if st.session_state.get("username"):
+        return "user:" + st.session_state["username"]
+    return "token:" + hashlib.sha256(st.session_state["token"].encode("utf-8")).hexdigest()[:32]
+
+def load_conversation():
+    """Loads the latest turns of the owner's conversation into the session window."""
+    total = get_conversation_store().count(conversation_owner())
+    start = max(0, total - CONVERSATION_MEMORY_TURNS)
+    st.session_state["conversations"] = get_conversation_store().load(conversation_owner(), start, total)
+    st.session_state["conversation_owner"] = conversation_owner()
+    st.session_state["conversation_offset"] = start
+    st.session_state["turn_count"] = total
+    st.session_state["rendered_count"] = total
+    st.session_state["new_reply_turns"] = set()
+
+def get_turns(start, end):
     """
-    Renders all conversation turns with st.chat_message,
-    ensuring old turns also display graphs in expanders,
-    and that new turns show the code as well.
+    Turns start..end-1, from the in-memory window when possible (and when
+    none of them had their payloads evicted by enforce_memory_budget).
     """
-    for i, convo in enumerate(st.session_state["conversations"]):
-        is_new_turn = (i >= st.session_state["rendered_count"])
+    offset = st.session_state["conversation_offset"]
+    if start >= offset:
+        turns = st.session_state["conversations"][start - offset:end - offset]
+        if not any(turn.get("evicted") for turn in turns):
+            return turns
+    return get_conversation_store().load(conversation_owner(), start, end)
 
-        # (A) User message
-        with st.chat_message("user"):
-            if is_new_turn:
-                ph = st.empty()
-                animate_text(convo["user_message"], ph)
+def append_turn(turn):
+    """Stores a new turn and returns its seq, allocated by the store."""
+    seq = get_conversation_store().append(conversation_owner(), turn)
+    if seq != st.session_state["turn_count"]:
+        # Another session of the same owner (another tab) appended turns meanwhile
+        load_conversation()
+        return seq
+    st.session_state["conversations"].append(turn)
+    st.session_state["turn_count"] += 1
+    excess = len(st.session_state["conversations"]) - CONVERSATION_MEMORY_TURNS
+    if excess > 0:
+        del st.session_state["conversations"][:excess]
+        st.session_state["conversation_offset"] += excess
+    return seq
+
+def clear_conversation():
+    cancel_agent_jobs(keep=False)
+    get_conversation_store().clear(conversation_owner())
+    st.session_state["conversations"] = []
+    st.session_state["conversation_offset"] = 0
+    st.session_state["turn_count"] = 0
+    st.session_state["rendered_count"] = 0
+    st.session_state["new_reply_turns"] = set()
+
+def valid_turns(data):
+    return isinstance(data, list) and all(
+        isinstance(t, dict) and isinstance(t.get("user_message"), str) and isinstance(t.get("agent_replies"), list)
+        for t in data
+    )
+
+def conversation_transfer():
+    """Bulk export / import of the whole stored conversation as JSON."""
+    with st.expander("Export / import conversation"):
+        if st.button("Prepare export"):
+            st.download_button(
+                "Download conversation.json",
+                json.dumps(get_conversation_store().export(conversation_owner()), indent=1),
+                file_name="conversation.json",
+                mime="application/json"
+            )
+        uploaded = st.file_uploader("Import conversation", type="json", key="conversation_import")
+        if uploaded is not None and st.button("Import"):
+            try:
+                turns = json.load(uploaded)
+            except ValueError:
+                turns = None
+            if not valid_turns(turns):
+                st.error("Not a conversation export.")
             else:
-                st.write(convo["user_message"])
+                get_conversation_store().import_turns(conversation_owner(), turns)
+                load_conversation()
+                st.rerun()
+
+# ---------------------------
+# Memory accounting (session state size, budget eviction, RSS)
+# ---------------------------
+def estimate_size(obj):
+    """
+    Approximate deep size in bytes of plain session data: containers,
+    strings, numbers and DataFrames. Other objects count only their own header.
+    """
+    seen = set()
+    size = 0
+    stack = [obj]
+    while stack:
+        item = stack.pop()
+        if id(item) in seen:
+            continue
+        seen.add(id(item))
+        size += sys.getsizeof(item, 0)
+        if isinstance(item, dict):
+            stack.extend(item.keys())
+            stack.extend(item.values())
+        elif isinstance(item, (list, tuple, set, frozenset, deque)):
+            stack.extend(item)
+        elif hasattr(item, "memory_usage") and hasattr(item, "columns"):
+            size += int(item.memory_usage(deep=True).sum())
+    return size
+
+def session_state_sizes():
+    """Estimated bytes per session_state key."""
+    return {key: estimate_size(value) for key, value in st.session_state.to_dict().items()}
+
+def process_rss(pid="self"):
+    """Resident set size in bytes, or None where /proc is not available."""
+    try:
+        with open(f"/proc/{pid}/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+def without_payloads(turn):
+    """Copy of a turn without its chart payloads, or None when it has none."""
+    heavy = ("graph", "chart_spec")
+    if not any(r.get("type") in heavy and r.get("content") for r in turn["agent_replies"]):
+        return None
+    return dict(turn, evicted=True, agent_replies=[
+        dict(r, content="") if r.get("type") in heavy else r for r in turn["agent_replies"]
+    ])
+
+def enforce_memory_budget():
+    """
+    Keeps the session's state under SESSION_MEMORY_BUDGET_MB. The oldest
+    in-memory turns outside the chat window leave memory first, then the
+    chart payloads of the remaining turns, oldest first; turns of running
+    jobs are left alone. Returns the estimated state size after eviction.
+    """
+    budget = SESSION_MEMORY_BUDGET_MB * 1024 * 1024
+    size = sum(session_state_sizes().values())
+    if size <= budget:
+        return size
+    conversations = st.session_state["conversations"]
+    running = st.session_state["agent_jobs"]
+    offset = st.session_state["conversation_offset"]
+    before = size
+    dropped = 0
+    while (size > budget and conversations and offset not in running
+           and offset < chat_window_start(st.session_state["turn_count"])):
+        size -= estimate_size(conversations.pop(0))
+        offset += 1
+        dropped += 1
+    st.session_state["conversation_offset"] = offset
+    stripped = 0
+    for i, turn in enumerate(conversations):
+        if size <= budget:
+            break
+        light = None if offset + i in running else without_payloads(turn)
+        if light is not None:
+            size -= estimate_size(turn) - estimate_size(light)
+            conversations[i] = light
+            stripped += 1
+    if dropped or stripped:
+        perf_count("memory_evictions", dropped, label="turn")
+        perf_count("memory_evictions", stripped, label="payload")
+        get_perf_logger().info(json.dumps({
+            "event": "memory_eviction",
+            "session": current_session_id(),
+            "budget_bytes": int(budget),
+            "bytes_before": before,
+            "bytes_after": size,
+            "turns_dropped": dropped,
+            "payloads_dropped": stripped,
+        }))
+    return size
+
+def record_memory(state_bytes):
+    perf_gauge("session_state_bytes", state_bytes, session=True)
+    perf_gauge("session_turns_in_memory", len(st.session_state["conversations"]), session=True)
+    if PERF_ENABLED:
+        perf_gauge("process_rss_bytes", process_rss() or 0)
+        perf_gauge("graph_workers_rss_bytes", get_graph_engine().worker_rss())
+        perf_gauge("chart_cache_bytes", get_chart_cache().stats()["bytes"])
+        perf_gauge("table_cache_bytes", get_table_cache().stats()["bytes"])
+
+# ---------------------------
+# Graph rendering (content-addressed chart cache)
+# ---------------------------
+class ChartCache:
+    """Thread-safe LRU of rendered outputs (charts, parsed tables), bounded by total bytes."""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
 
-        # (B) Agent replies
+    def put(self, key, outputs, size):
+        with self._lock:
+            if key in self._entries:
+                self.total_bytes -= self._entries.pop(key)[1]
+            if size > self.max_bytes:
+                return
+            self._entries[key] = (outputs, size)
+            self.total_bytes += size
+            while self.total_bytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.total_bytes -= evicted_size
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._entries
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "entries": len(self._entries),
+                "bytes": self.total_bytes,
+            }
+
+@st.cache_resource
+def get_chart_cache():
+    return ChartCache(GRAPH_CACHE_MAX_BYTES)
+
+def graph_cache_key(code, chart_spec=False):
+    theme = st.get_option("theme.base") or ""
+    mode = f"spec{CHART_MAX_POINTS}{CHART_DOWNSAMPLE}" if chart_spec else "image"
+    salt = f"{GRAPH_CACHE_VERSION}|{theme}|{mode}|"
+    return hashlib.sha256((salt + code).encode("utf-8")).hexdigest()
+
+class GraphWorkersBusy(Exception):
+    pass
+
+class GraphEngine:
+    """
+    Runs GraphAgent code in a warm process pool (see graph_worker.py).
+    Identical snippets in flight share one future, and a pool whose worker
+    died or hung is torn down and replaced instead of blocking the server.
+    """
+
+    def __init__(self, workers):
+        self.workers = workers
+        self._lock = threading.Lock()
+        self._inflight = {}
+        self._pool = self._new_pool()
+
+    def _new_pool(self):
+        if "forkserver" in multiprocessing.get_all_start_methods():
+            ctx = multiprocessing.get_context("forkserver")
+            ctx.set_forkserver_preload(["graph_worker_env", "graph_worker", "matplotlib.pyplot"])
+        else:
+            ctx = multiprocessing.get_context("spawn")
+        return ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=ctx,
+            initializer=graph_worker.init_worker,
+            initargs=(GRAPH_MAX_MEMORY_MB * 1024 * 1024,),
+            max_tasks_per_child=GRAPH_TASKS_PER_WORKER
+        )
+
+    def worker_rss(self):
+        """Total resident memory of the live workers, in bytes."""
+        processes = getattr(self._pool, "_processes", None) or {}
+        return sum(process_rss(pid) or 0 for pid in list(processes))
+
+    def _reset(self, pool):
+        """Replaces `pool` unless another caller already did; True if this call replaced it."""
+        with self._lock:
+            if self._pool is not pool:
+                return False
+            self._pool = self._new_pool()
+            self._inflight.clear()
+        for process in list((getattr(pool, "_processes", None) or {}).values()):
+            process.terminate()
+        pool.shutdown(wait=False, cancel_futures=True)
+        return True
+
+    def submit(self, key, code, chart_spec=False):
+        with self._lock:
+            future = self._inflight.get(key)
+            if future is None:
+                future = self._pool.submit(
+                    graph_worker.run_graph_code, code, GRAPH_CPU_SECONDS, GRAPH_WALL_SECONDS, chart_spec
+                )
+                future.pool = self._pool
+                self._inflight[key] = future
+            return future
+
+    def _forget(self, key, future):
+        with self._lock:
+            if self._inflight.get(key) is future:
+                del self._inflight[key]
+
+    @staticmethod
+    def _result(future):
+        """
+        Waits for `future`, timing it from when the pool hands it to a worker
+        rather than from submission, so code queued behind busy workers is not
+        taken for hung code. The pool marks a task running once it enters its
+        call queue, which holds one task beyond the busy workers, so a running
+        task may still wait up to one wall limit for a worker. Raises
+        GraphWorkersBusy after GRAPH_QUEUE_SECONDS without a worker and
+        FutureTimeoutError once the task has run far past the worker's own
+        limits (which normally stop it first).
+        """
+        queued_until = time.monotonic() + GRAPH_QUEUE_SECONDS
+        started = None
+        while True:
+            try:
+                return future.result(timeout=0.25)
+            except FutureTimeoutError:
+                now = time.monotonic()
+                if started is None and future.running():
+                    started = now
+                if started is None and now > queued_until:
+                    raise GraphWorkersBusy() from None
+                if started is not None and now - started > 2 * GRAPH_WALL_SECONDS + 5:
+                    raise
+
+    def run(self, key, code, chart_spec=False):
+        """
+        Returns (outputs, cacheable) for `code`, submitting it if not already
+        in flight. Failures of the pool itself and snippets stopped by a
+        resource limit (which may pass on a less loaded worker) are reported
+        but not cached.
+        Only a snippet that has been running past the limits takes the pool
+        down; one still waiting for a worker is reported as busy and stays
+        queued for the next render. Code that was cancelled or lost with a
+        pool another caller already replaced (after its own snippet hung or
+        crashed) is submitted once more to the new pool.
+        """
+        for retry in (True, False):
+            future = self.submit(key, code, chart_spec)
+            try:
+                outputs = self._result(future)
+            except GraphWorkersBusy:
+                return [("error", "All graph workers are busy, please try again shortly")], False
+            except FutureTimeoutError:
+                self._forget(key, future)
+                self._reset(future.pool)
+                return [("error", "Time limit exceeded")], False
+            except (CancelledError, BrokenProcessPool):
+                self._forget(key, future)
+                if not self._reset(future.pool) and retry:
+                    continue
+                return [("error", "Graph worker crashed (likely over its memory or CPU limit)")], False
+            self._forget(key, future)
+            return outputs, not any(output[0] == "limit" for output in outputs)
+
+@st.cache_resource
+def get_graph_engine():
+    return GraphEngine(GRAPH_WORKERS)
+
+def outputs_size(outputs):
+    size = 0
+    for output in outputs:
+        if output[0] == "image":
+            size += len(output[1])
+        else:
+            try:
+                size += len(pickle.dumps(output))
+            except Exception:
+                size += 64 * 1024
+    return size
+
+def render_graph(code, chart_spec=False):
+    """
+    Displays the output of GraphAgent code, replaying it from the chart cache
+    when the same code was rendered before. With chart_spec, figures that can
+    be expressed as Vega-Lite specs are drawn natively instead of as images.
+    Returns an error message if the code raised, else None.
+    """
+    cache = get_chart_cache()
+    key = graph_cache_key(code, chart_spec)
+    outputs = cache.get(key)
+    perf_count("chart_cache", label="miss" if outputs is None else "hit")
+    if outputs is None:
+        with perf_timed("graph_exec"):
+            outputs, cacheable = get_graph_engine().run(key, code, chart_spec)
+        outputs = [("spec", downsample_spec(o[1])) if o[0] == "spec" else o for o in outputs]
+        if cacheable:
+            cache.put(key, outputs, outputs_size(outputs))
+    return replay_outputs(outputs)
+
+def render_spec(content):
+    """Draws a Vega-Lite spec reply (JSON text), downsampled once and then cached."""
+    cache = get_chart_cache()
+    key = "spec:" + graph_cache_key(content, chart_spec=True)
+    outputs = cache.get(key)
+    perf_count("chart_cache", label="miss" if outputs is None else "hit")
+    if outputs is None:
+        try:
+            outputs = [("spec", downsample_spec(json.loads(content)))]
+        except (ValueError, TypeError, KeyError) as exc:
+            outputs = [("error", f"Invalid chart spec: {exc}")]
+        cache.put(key, outputs, outputs_size(outputs))
+    return replay_outputs(outputs)
+
+def render_chart(reply):
+    """Renders a GraphAgent reply (chart code or chart spec); returns an error message or None."""
+    if reply.get("type") == "chart_spec":
+        return render_spec(reply["content"])
+    return render_graph(reply["content"], reply.get("chart_spec", False))
+
+def replay_outputs(outputs):
+    error = None
+    for output in outputs:
+        if output[0] == "image":
+            st.image(output[1])
+        elif output[0] == "spec":
+            st.vega_lite_chart(output[1])
+        elif output[0] == "call":
+            _, name, args, kwargs = output
+            getattr(st, name)(*args, **kwargs)
+        else:
+            error = output[1]
+    return error
+
+def prefetch_graphs(conversations):
+    """Submits every uncached graph in the conversation so they render in parallel."""
+    cache = get_chart_cache()
+    for convo in conversations:
         for reply in convo["agent_replies"]:
-            agent_name = reply.get("agent", "Agent")
-            content = reply.get("content", "")
-            msg_type = reply.get("type", "text")
+            if reply.get("type") == "graph" and reply.get("content", "").strip():
+                chart_spec = reply.get("chart_spec", False)
+                key = graph_cache_key(reply["content"], chart_spec)
+                if key not in cache:
+                    # The pool is only created once a chart actually needs it
+                    get_graph_engine().submit(key, reply["content"], chart_spec)
+
+# ---------------------------
+# Chart specs (Vega-Lite, downsampled with NumPy before they reach the browser)
+# ---------------------------
+DOWNSAMPLED_MARKS = {"line", "area", "point", "circle", "square", "trail", "tick"}
+
+def lttb_indices(x, y, n_out):
+    """
+    Indices of the points kept by largest-triangle-three-buckets: the first
+    and last point, plus per bucket the point forming the largest triangle
+    with the previously kept point and the next bucket's average.
+    """
+    import numpy as np
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    # Next-bucket averages are independent of the selection, so compute them at once
+    sums_x = np.add.reduceat(x[1:n - 1], edges[:-1] - 1)
+    sums_y = np.add.reduceat(y[1:n - 1], edges[:-1] - 1)
+    counts = np.diff(edges)
+    avg_x = np.append(sums_x / counts, x[-1])[1:]
+    avg_y = np.append(sums_y / counts, y[-1])[1:]
+    kept = np.empty(n_out, dtype=np.int64)
+    kept[0], kept[-1] = 0, n - 1
+    a = 0
+    for i in range(n_out - 2):
+        lo, hi = edges[i], edges[i + 1]
+        area = np.abs(
+            (x[a] - avg_x[i]) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (avg_y[i] - y[a])
+        )
+        a = lo + int(np.argmax(area))
+        kept[i + 1] = a
+    return kept
+
+def minmax_indices(y, n_out):
+    """
+    At most n_out indices, in order: the first and last point plus the minimum
+    and maximum of each of (n_out - 2) // 2 equal buckets of the points between.
+    """
+    import numpy as np
+    n = len(y)
+    if n <= n_out:
+        return np.arange(n)
+    buckets = (n_out - 2) // 2
+    if buckets < 1:
+        return np.array([0, n - 1])
+    inner = n - 2
+    bucket = np.arange(inner) * buckets // inner
+    order = np.lexsort((y[1:n - 1], bucket))
+    starts = np.searchsorted(bucket[order], np.arange(buckets))
+    ends = np.append(starts[1:], inner) - 1
+    return np.unique(np.concatenate([[0], order[starts] + 1, order[ends] + 1, [n - 1]]))
+
+def _numeric_axis(values):
+    """Values of an x or y field as float64, or None when they are not numbers or dates."""
+    import numpy as np
+    try:
+        return np.asarray(values, dtype=np.float64)
+    except (TypeError, ValueError):
+        pass
+    try:
+        return np.asarray(values, dtype="datetime64[ms]").astype(np.float64)
+    except (TypeError, ValueError):
+        return None
+
+def downsample_spec(spec, max_points=None, method=None):
+    """
+    Copy of a Vega-Lite spec whose inline data keeps at most max_points rows
+    per series (the color/detail field) for line, area and point marks.
+    Other specs are returned unchanged.
+    """
+    import numpy as np
+    max_points = max_points or CHART_MAX_POINTS
+    method = method or CHART_DOWNSAMPLE
+    values = (spec.get("data") or {}).get("values")
+    mark = spec.get("mark")
+    mark = mark.get("type") if isinstance(mark, dict) else mark
+    encoding = spec.get("encoding") or {}
+    x_field = (encoding.get("x") or {}).get("field")
+    y_field = (encoding.get("y") or {}).get("field")
+    if (not isinstance(values, list) or len(values) <= max_points or mark not in DOWNSAMPLED_MARKS
+            or not x_field or not y_field):
+        return spec
+    series_field = (encoding.get("color") or encoding.get("detail") or {}).get("field")
+    series = {}
+    for i, row in enumerate(values):
+        series.setdefault(row.get(series_field) if series_field else None, []).append(i)
+    per_series = max(3, max_points // len(series))
+    kept = []
+    for rows in series.values():
+        rows = np.asarray(rows)
+        if len(rows) <= per_series:
+            kept.append(rows)
+            continue
+        y = _numeric_axis([values[i].get(y_field) for i in rows])
+        if y is None:
+            return spec
+        x = _numeric_axis([values[i].get(x_field) for i in rows])
+        if x is None:
+            x = np.arange(len(rows), dtype=np.float64)
+        if method == "minmax":
+            kept.append(rows[minmax_indices(y, per_series)])
+        else:
+            order = np.argsort(x, kind="stable")
+            kept.append(rows[order[lttb_indices(x[order], y[order], per_series)]])
+    kept = np.sort(np.concatenate(kept))
+    data = dict(spec["data"], values=[values[i] for i in kept])
+    return dict(spec, data=data)
+
+# ---------------------------
+# Tabular replies (parsed once into Arrow-backed DataFrames, paged on the server)
+# ---------------------------
+TABLE_FENCE = re.compile(r"^\s*```\s*(csv|tsv)\s*$", re.IGNORECASE)
+MARKDOWN_TABLE_RULE = re.compile(r"^\s*\|?\s*:?-{3,}:?\s*(\|\s*:?-{3,}:?\s*)+\|?\s*$")
+
+def _markdown_cells(line):
+    line = line.strip()
+    if line.startswith("|"):
+        line = line[1:]
+    if line.endswith("|") and not line.endswith("\\|"):
+        line = line[:-1]
+    return [cell.strip().replace("\\|", "|") for cell in re.split(r"(?<!\\)\|", line)]
+
+def _delimited_width(line, delimiter):
+    """Number of fields of a delimited line, or 0 when it holds no delimiter."""
+    if delimiter not in line:
+        return 0
+    return len(next(csv.reader([line], delimiter=delimiter)))
+
+def split_table_blocks(text):
+    """
+    Splits a reply into ("text", markdown) and ("table", csv_text, delimiter)
+    blocks. Recognizes markdown pipe tables, ```csv/```tsv fences and runs of
+    at least TABLE_MIN_ROWS tab-separated lines with the same number of
+    fields. Bare comma-separated lines are left as prose, since numbers and
+    lists in sentences ("North: 1,234,567") look the same.
+    """
+    lines = text.split("\n")
+    blocks = []
+    prose = []
+
+    def table(csv_text, delimiter):
+        if prose:
+            blocks.append(("text", "\n".join(prose)))
+            prose.clear()
+        blocks.append(("table", csv_text, delimiter))
+
+    i = 0
+    while i < len(lines):
+        line = lines[i]
+        fence = TABLE_FENCE.match(line)
+        if fence:
+            end = next((j for j in range(i + 1, len(lines)) if lines[j].strip() == "```"), None)
+            if end is not None:
+                table("\n".join(lines[i + 1:end]), "\t" if fence.group(1).lower() == "tsv" else ",")
+                i = end + 1
+                continue
+        if "|" in line and i + 1 < len(lines) and MARKDOWN_TABLE_RULE.match(lines[i + 1]):
+            header = _markdown_cells(line)
+            if len(header) == len(_markdown_cells(lines[i + 1])):
+                end = i + 2
+                while end < len(lines) and "|" in lines[end] and lines[end].strip():
+                    end += 1
+                out = io.StringIO()
+                writer = csv.writer(out)
+                writer.writerow(header)
+                for row in lines[i + 2:end]:
+                    cells = _markdown_cells(row)
+                    writer.writerow((cells + [""] * len(header))[:len(header)])
+                table(out.getvalue(), ",")
+                i = end
+                continue
+        width = _delimited_width(line, "\t")
+        if width >= 2:
+            end = i + 1
+            while end < len(lines) and _delimited_width(lines[end], "\t") == width:
+                end += 1
+            if end - i >= TABLE_MIN_ROWS:
+                table("\n".join(lines[i:end]), "\t")
+                i = end
+                continue
+        prose.append(line)
+        i += 1
+    if prose:
+        blocks.append(("text", "\n".join(prose)))
+    return blocks
+
+def parse_table(csv_text, delimiter):
+    """DataFrame with pyarrow-backed columns, or None when the block does not parse."""
+    import pandas as pd
+    try:
+        frame = pd.read_csv(io.StringIO(csv_text), sep=delimiter, dtype_backend="pyarrow",
+                            skipinitialspace=True)
+    except (ValueError, pd.errors.ParserError):
+        return None
+    return frame if len(frame.columns) > 1 else None
+
+def parse_reply(content):
+    """Reply split into ("text", markdown) and ("table", DataFrame) segments."""
+    segments = []
+    for block in split_table_blocks(content):
+        frame = parse_table(block[1], block[2]) if block[0] == "table" else None
+        if frame is not None:
+            segments.append(("table", frame))
+        else:
+            # Unparseable blocks are shown as they were written
+            text = block[1] if block[0] == "text" else f"```\n{block[1]}\n```"
+            if segments and segments[-1][0] == "text":
+                segments[-1] = ("text", segments[-1][1] + "\n" + text)
+            else:
+                segments.append(("text", text))
+    return segments
+
+@st.cache_resource
+def get_table_cache():
+    return ChartCache(TABLE_CACHE_MAX_BYTES)
 
+def reply_segments(content):
+    """Parsed segments of a text reply; each distinct reply is parsed only once per process."""
+    cache = get_table_cache()
+    key = hashlib.sha256(content.encode("utf-8")).hexdigest()
+    segments = cache.get(key)
+    perf_count("table_cache", label="miss" if segments is None else "hit")
+    if segments is None:
+        with perf_timed("table_parse"):
+            segments = parse_reply(content)
+        size = sum(
+            int(value.memory_usage(deep=True).sum()) if kind == "table" else len(value)
+            for kind, value in segments
+        )
+        cache.put(key, segments, size)
+    return segments
+
+def table_page(frame, key):
+    """One page of a large table; paging reruns only this fragment."""
+    rows = len(frame)
+    pages = math.ceil(rows / TABLE_PAGE_ROWS)
+    page = st.session_state.get(key, 1)
+    start = (page - 1) * TABLE_PAGE_ROWS
+    end = min(rows, start + TABLE_PAGE_ROWS)
+    # Only the visible slice is serialized and sent to the browser
+    st.dataframe(frame.iloc[start:end], hide_index=True)
+    cols = st.columns([1, 4])
+    cols[0].number_input(f"Page (of {pages:,})", min_value=1, max_value=pages, step=1, key=key)
+    cols[1].caption(f"Rows {start + 1:,}–{end:,} of {rows:,} · {len(frame.columns)} columns")
+
+def render_table(frame, key):
+    if len(frame) <= TABLE_PAGE_ROWS:
+        st.dataframe(frame, hide_index=True)
+    else:
+        st.fragment(table_page)(frame, key)
+
+def render_text_reply(agent_name, content, key, animate=False):
+    """
+    Renders a text reply; tables in it are shown as paged dataframes and
+    only the surrounding prose gets the typing effect.
+    """
+    segments = reply_segments(content)
+    for i, (kind, value) in enumerate(segments):
+        if kind == "table":
+            if i == 0:
+                st.markdown(f"**{agent_name}:**")
+            render_table(value, f"{key}_table_{i}")
+            continue
+        text = f"**{agent_name}:** {value}" if i == 0 else value
+        if animate:
+            animate_text(text, st.empty())
+        elif text.strip():
+            st.markdown(text)
+
+# ---------------------------
+# Render Chat (with partial typing & graphs)
+# ---------------------------
+def render_turn(convo, seq, is_new_turn, new_replies=False):
+    """
+    Renders conversation turn `seq`; new turns get the typing effect, and so
+    do the replies alone with new_replies.
+    """
+    # (A) User message
+    with st.chat_message("user"):
+        if is_new_turn:
+            ph = st.empty()
+            animate_text(convo["user_message"], ph)
+        else:
+            st.write(convo["user_message"])
+
+    # (B) Agent replies
+    for n, reply in enumerate(convo["agent_replies"]):
+        key = f"reply_{seq}_{n}"
+        agent_name = reply.get("agent", "Agent")
+        content = reply.get("content", "")
+        msg_type = reply.get("type", "text")
+        if reply.get("cached"):
+            agent_name += " (cached)"
+
+        with st.chat_message("assistant"):
+            if not (is_new_turn or new_replies):
+                # OLD turn (already rendered before)
+                if msg_type == "text":
+                    render_text_reply(agent_name, content, key)
+                elif msg_type in ("graph", "chart_spec"):
+                    st.markdown(f"**{agent_name}** generated a graph previously:")
+                    if content.strip() == "":
+                        st.write("Graph not generated.")
+                    else:
+                        # [MODIFIED] - Execute the old graph code in an expander
+                        with st.expander("View Previous Graph"):
+                            error = render_chart(reply)
+                            if error:
+                                st.write(f"Error executing previous graph code: {error}")
+                st.markdown("---")
+            else:
+                # NEW turn
+                if msg_type == "text" and (reply.get("streamed") or reply.get("cached")):
+                    # Already shown token by token while streaming, or answered from the cache
+                    render_text_reply(agent_name, content, key)
+
+                elif msg_type == "text":
+                    render_text_reply(agent_name, content, key, animate=True)
+
+                elif msg_type in ("graph", "chart_spec"):
+                    ph = st.empty()
+                    if content.strip() == "":
+                        animate_text(f"**{agent_name}**: Graph not generated.", ph)
+                    else:
+                        # [MODIFIED] - Execute the new graph code
+                        animate_text(f"**{agent_name}** generated a graph:", ph)
+                        with st.expander("View Graph"):
+                            error = render_chart(reply)
+                            if error:
+                                st.write(f"Error executing graph code: {error}")
+                st.markdown("---")
+
+def render_chat():
+    """
+    Renders the conversation with st.chat_message. Only the most recent
+    turns (at least CHAT_WINDOW_TURNS) are rendered in full; older turns are
+    grouped into pages of CHAT_PAGE_TURNS that are rendered only while their
+    toggle is on, so rerun cost stays flat as the session grows.
+    """
+    with perf_timed("render_chat"):
+        _render_chat()
+
+def chat_window_start(total):
+    """First turn rendered in full. Page boundaries are fixed multiples of CHAT_PAGE_TURNS so toggles keep their state."""
+    return max(0, (total - CHAT_WINDOW_TURNS) // CHAT_PAGE_TURNS * CHAT_PAGE_TURNS)
+
+def _render_chat():
+    total = st.session_state["turn_count"]
+    rendered_count = st.session_state["rendered_count"]
+    new_reply_turns = st.session_state["new_reply_turns"]
+    window_start = chat_window_start(total)
+
+    for page_start in range(0, window_start, CHAT_PAGE_TURNS):
+        page_end = page_start + CHAT_PAGE_TURNS
+        if st.toggle(f"Show earlier turns {page_start + 1}–{page_end}", key=f"chat_page_{page_start}"):
+            page = get_turns(page_start, page_end)
+            prefetch_graphs(page)
+            for i, convo in enumerate(page, start=page_start):
+                render_turn(convo, i, is_new_turn=False)
+
+    window = get_turns(window_start, total)
+    prefetch_graphs(window)
+    for i, convo in enumerate(window, start=window_start):
+        render_turn(convo, i, is_new_turn=(i >= rendered_count), new_replies=(i in new_reply_turns))
+
+    st.session_state["rendered_count"] = total
+    st.session_state["new_reply_turns"] = set()
+
+# ---------------------------
+# Background job progress
+# ---------------------------
+def cancel_agent_jobs(keep=True):
+    for job in st.session_state["agent_jobs"].values():
+        job.cancel(keep)
+    st.session_state["agent_jobs"] = {}
+
+def sync_agent_jobs():
+    """
+    Copies the turns of finished jobs into the session window (the store
+    already has them) and returns how many jobs finished.
+    """
+    jobs = st.session_state["agent_jobs"]
+    finished = [seq for seq, job in jobs.items() if job.status != "running"]
+    for seq in finished:
+        job = jobs.pop(seq)
+        turn = job.snapshot()
+        offset = st.session_state["conversation_offset"]
+        if 0 <= seq - offset < len(st.session_state["conversations"]):
+            st.session_state["conversations"][seq - offset] = turn
+        # Animate the answers like a turn answered in the foreground; the user
+        # message and the turns after it were already shown
+        st.session_state["new_reply_turns"].add(seq)
+    return len(finished)
+
+def agent_job_poll_interval():
+    if not st.session_state["agent_jobs"]:
+        return None
+    return 0.5 if any(job.streamed for job in st.session_state["agent_jobs"].values()) else 1.0
+
+def queue_caption():
+    position = get_client().queue_position(current_session_id())
+    if position:
+        st.caption(
+            f"Backend busy: waiting for a slot, {position} {'user' if position == 1 else 'users'} ahead of you"
+        )
+
+def pending_turns():
+    """
+    Live view of the running jobs below the chat: replies received so far,
+    streamed text and a Cancel button. Reruns the app once a job finishes.
+    """
+    jobs = st.session_state["agent_jobs"]
+    if any(job.status != "running" for job in jobs.values()):
+        st.rerun()
+    for seq, job in sorted(jobs.items()):
+        replies, streaming = job.progress()
+        for reply in replies:
             with st.chat_message("assistant"):
-                if not is_new_turn:
-                    # OLD turn (already rendered before)
-                    if msg_type == "text":
-                        st.markdown(f"**{agent_name}:** {content}")
-                    elif msg_type == "graph":
-                        st.markdown(f"**{agent_name}** generated a graph previously:")
-                        if content.strip() == "":
-                            st.write("Graph not generated.")
-                        else:
-                            # [MODIFIED] - Execute the old graph code in an expander
-                            with st.expander("View Previous Graph"):
-                                try:
-                                    exec(content, globals())
-                                except Exception as e:
-                                    st.write(f"Error executing previous graph code: {e}")
-                    st.markdown("---")
+                if reply["type"] in ("graph", "chart_spec"):
+                    st.markdown(f"**{reply['agent']}** generated a graph.")
                 else:
-                    # NEW turn
-                    if msg_type == "text":
-                        ph = st.empty()
-                        with st.spinner(f"{agent_name} is typing..."):
-                            time.sleep(1)
-                        animate_text(f"**{agent_name}:** {content}", ph)
-
-                    elif msg_type == "graph":
-                        ph = st.empty()
-                        with st.spinner(f"{agent_name} is generating a graph..."):
-                            time.sleep(2)
-                        if content.strip() == "":
-                            animate_text(f"**{agent_name}**: Graph not generated.", ph)
-                        else:
-                            # [MODIFIED] - Execute the new graph code
-                            animate_text(f"**{agent_name}** generated a graph:", ph)
-                            with st.expander("View Graph"):
-                                try:
-                                    exec(content, globals())
-                                except Exception as e:
-                                    st.write(f"Error executing graph code: {e}")
-                    st.markdown("---")
-
-    st.session_state["rendered_count"] = len(st.session_state["conversations"])
+                    st.markdown(f"**{reply['agent']}:** {reply['content']}")
+        for agent, text in streaming.items():
+            with st.chat_message("assistant"):
+                st.markdown(f"**{agent}:** {text}")
+        with st.chat_message("assistant"):
+            cols = st.columns([6, 1])
+            cols[0].markdown(
+                f"⏳ Agents are working on “{job.turn['user_message']}” "
+                f"({time.monotonic() - job.started:.0f} s, {max(0, job.deadline.remaining()):.0f} s left)"
+            )
+            if cols[1].button("Cancel", key=f"cancel_job_{seq}"):
+                job.cancel()
+                st.rerun()
+    queue_caption()
+
+def background_jobs_status():
+    """Sidebar note on other pages while jobs run; reruns the app once one finishes."""
+    jobs = st.session_state["agent_jobs"]
+    if any(job.status != "running" for job in jobs.values()):
+        st.rerun()
+    oldest = min(job.started for job in jobs.values())
+    st.info(
+        f"⏳ {len(jobs)} {'analysis' if len(jobs) == 1 else 'analyses'} running "
+        f"({time.monotonic() - oldest:.0f} s). Answers will appear in Data Insights."
+    )
+    queue_caption()
+    if st.button("Cancel", key="cancel_background_jobs"):
+        cancel_agent_jobs()
+        st.rerun()
 
 # ---------------------------
 # Main Streamlit App
@@ -266,6 +3058,9 @@ def main():
     
     if st.session_state["token"]:
         # Authenticated
+        if st.session_state.get("conversation_owner") != conversation_owner():
+            cancel_agent_jobs(keep=True)
+            load_conversation()
         header_cols = st.columns([8, 1])
         with header_cols[0]:
             st.title("DataDash - AI Powered Business Insights")
@@ -279,150 +3074,24 @@ def main():
                 ["Home", "Data Insights"],  
                 icons=['house', 'file-text'], 
                 menu_icon="list",
-                styles={
-                    "container": {"padding": "0!important", "background-color": "transparent"},
-                    "icon": {"color": "#ffffff", "font-size": "20px"},
-                    "nav-link": {
-                        "font-size": "16px", 
-                        "text-align": "left", 
-                        "margin": "2px", 
-                        "--hover-color": "#ff2b2b",
-                        "color": "white"
-                    },
-                    "nav-link-selected": {"background-color": "#ff2b2b"},
-                }
+                styles=sidebar_menu_styles()
             )
+            if PERF_ENABLED:
+                performance_panel()
+
+        if sync_agent_jobs() and page != "Data Insights":
+            st.toast("Your analysis is ready in Data Insights.")
+        record_memory(enforce_memory_budget())
+        if st.session_state["agent_jobs"] and page != "Data Insights":
+            with st.sidebar:
+                st.fragment(run_every=agent_job_poll_interval())(background_jobs_status)()
         
         if page == "Home":
             tab1, tab2, tab3 = st.tabs(["Upload", "Uploaded", "Status"])
 
             with tab1:
                 # Dropzone for uploading
-                token = st.session_state["token"]
-                dropzone_html = f"""
-                <!DOCTYPE html>
-                <html lang="en">
-                <head>
-                    <style>
-                        :root {{
-                            --primary-color: #BB86FC;
-                            --background-color: #F0F2F6;
-                            --text-color: #333333;
-                            --font: "Source Sans Pro", sans-serif;
-                        }}
-                        .dropzone {{
-                            border: 2px dashed var(--primary-color);
-                            border-radius: 5px;
-                            background: var(--background-color);
-                            padding: 20px;
-                            width: 100%;
-                            color: var(--text-color);
-                            font-family: var(--font);
-                            max-height: 500px;
-                            overflow-y: auto;
-                        }}
-                        .dropzone .dz-message {{
-                            font-size: 1.2em;
-                            color: var(--text-color);
-                        }}
-                        .dz-preview {{
-                            position: relative;
-                            background: var(--background-color);
-                            border: 1px solid var(--primary-color);
-                            border-radius: 5px;
-                            padding: 10px;
-                            margin-top: 10px;
-                        }}
-                        .delete-icon {{
-                            position: absolute;
-                            top: -10px;
-                            right: -10px;
-                            width: 24px;
-                            height: 24px;
-                            cursor: pointer;
-                            z-index: 1000;
-                            transition: transform 0.2s;
-                        }}
-                        .delete-icon:hover {{
-                            transform: scale(1.1);
-                        }}
-                        ::-webkit-scrollbar {{
-                            width: 8px;
-                        }}
-                        ::-webkit-scrollbar-track {{
-                            background: var(--background-color);
-                        }}
-                        ::-webkit-scrollbar-thumb {{
-                            background-color: var(--primary-color);
-                            border-radius: 4px;
-                        }}
-                    </style>
-                    <link rel="stylesheet" href="https://cdnjs.cloudflare.com/ajax/libs/dropzone/5.9.3/dropzone.min.css">
-                    <script src="https://cdnjs.cloudflare.com/ajax/libs/dropzone/5.9.3/dropzone.min.js"></script>
-                </head>
-                <body>
-                    <form action="{API_BASE}/upload" class="dropzone" id="fileDropzone">
-                        <div class="dz-message">
-                            Drag and drop files here or click to upload.
-                        </div>
-                    </form>
-                    <script>
-                        const jwtToken = "{token}";
-                        Dropzone.options.fileDropzone = {{
-                            paramName: "file",
-                            maxFilesize: 1024,
-                            uploadMultiple: false,
-                            parallelUploads: 2,
-                            timeout: 300000,
-                            clickable: true,
-                            autoProcessQueue: true,
-                            init: function() {{
-                                this.on("sending", function(file, xhr, formData) {{
-                                    xhr.setRequestHeader("Authorization", "Bearer " + jwtToken);
-                                }});
-                                this.on("addedfile", function(file) {{
-                                    let deleteIcon = document.createElement("img");
-                                    deleteIcon.src = "https://cdn2.iconfinder.com/data/icons/user-interface-presicon-line/64/cross-512.png";
-                                    deleteIcon.className = "delete-icon";
-                                    file.previewElement.appendChild(deleteIcon);
-                                    deleteIcon.addEventListener("click", function(e) {{
-                                        e.preventDefault();
-                                        e.stopPropagation();
-                                        this.removeFile(file);
-                                        fetch('{API_BASE}/delete', {{
-                                            method: 'POST',
-                                            headers: {{
-                                                'Content-Type': 'application/json',
-                                                'Authorization': 'Bearer ' + jwtToken
-                                            }},
-                                            body: JSON.stringify({{ filename: file.name }})
-                                        }})
-                                        .then(response => {{
-                                            if (response.ok) {{
-                                                return response.json();
-                                            }} else {{
-                                                throw new Error('Failed to delete file');
-                                            }}
-                                        }})
-                                        .then(data => {{
-                                            if (data.success) {{
-                                                console.log('File deleted successfully');
-                                            }} else {{
-                                                console.error('Error deleting file:', data.message || 'Unknown error');
-                                            }}
-                                        }})
-                                        .catch(error => {{
-                                            console.error('Error:', error);
-                                        }});
-                                    }}.bind(this));
-                                }});
-                            }}
-                        }};
-                    </script>
-                </body>
-                </html>
-                """
-                st.components.v1.html(dropzone_html, height=600)
+                st.components.v1.html(dropzone_html(st.session_state["token"]), height=600)
 
             with tab2:
                 display_files()
@@ -434,26 +3103,44 @@ def main():
             # --------------------------
             # Chat interface with partial typing
             # --------------------------
-            headers_req = {'Authorization': f"Bearer {st.session_state['token']}"}
+            client = get_client()
+            token = st.session_state['token']
             # Fetch user files for selection
-            file_resp = requests.get(f"{API_BASE}/get_user_files", headers=headers_req)
-            if file_resp.status_code == 200:
-                all_files_data = file_resp.json().get('files', [])
-                selected_files = st.multiselect("Select files to query", all_files_data, [])
+            all_files_data = fetch_files(token, "/get_user_files")
+            if all_files_data is not None:
+                if "query_files_pending" in st.session_state:
+                    # Files picked with "Use in queries" in the Status tab
+                    pending = st.session_state.pop("query_files_pending")
+                    st.session_state["query_files"] = [f for f in all_files_data if f in pending]
+                selected_files = st.multiselect("Select files to query", all_files_data, key="query_files")
             else:
                 st.error("Failed to fetch user files.")
                 selected_files = []
 
-            col_cb1, col_cb2 = st.columns(2)
+            col_cb1, col_cb2, col_cb3 = st.columns(3)
             with col_cb1:
                 graph_mode = st.checkbox("Generate Graph with answer?", value=False)
+                chart_spec_mode = graph_mode and st.checkbox(
+                    "Interactive chart?", value=False,
+                    help="Ask for a chart spec drawn in the browser, downsampled above "
+                         f"{CHART_MAX_POINTS} points, instead of a rendered image."
+                )
             with col_cb2:
                 web_mode = st.checkbox("Web Cross-Check?", value=False)
+            with col_cb3:
+                stream_mode = st.checkbox("Stream responses?", value=False)
+            response_cache = get_response_cache()
+            use_cached = response_cache is not None and st.checkbox(
+                "Reuse cached answers?", value=True,
+                help="Uncheck to ask the agents again; the fresh answer replaces the cached one."
+            )
 
             # Render existing conversation
             chat_container = st.container()
             with chat_container:
                 render_chat()
+                if st.session_state["agent_jobs"]:
+                    st.fragment(run_every=agent_job_poll_interval())(pending_turns)()
 
             # Input form for user message
             with st.form("chat_input_form", clear_on_submit=True):
@@ -466,116 +3153,45 @@ def main():
                         "user_message": user_input,
                         "agent_replies": []
                     }
-                    st.session_state["conversations"].append(new_turn)
-
-                    # Prepare aicore_result so we can reference it even if the request fails
-                    aicore_result = {}
+                    seq = append_turn(new_turn)
 
-                    # (2) AiCore request
-                    ai_payload = {
-                        "query": user_input,
-                        "files": selected_files,
-                        "history": st.session_state["conversations"]
-                    }
-                    try:
-                        with st.spinner("Excel & Text Agents are working..."):
-                            r = requests.post(
-                                f"{API_BASE}/run_aicore",
-                                headers=headers_req,
-                                json=ai_payload,
-                                timeout=180
-                            )
-                        if r.status_code == 200:
-                            aicore_result = r.json()  # e.g. {"ExcelAgent": "...", "TextAgent": "..."}
-                            excel_text = aicore_result.get("ExcelAgent", "")
-                            text_text = aicore_result.get("TextAgent", "")
-
-                            # If excel text is non-empty
-                            if excel_text.strip():
-                                st.session_state["conversations"][-1]["agent_replies"].append(
-                                    {"agent": "ExcelAgent", "content": excel_text, "type": "text"}
-                                )
-                            # If text agent has content
-                            if text_text.strip():
-                                st.session_state["conversations"][-1]["agent_replies"].append(
-                                    {"agent": "TextAgent", "content": text_text, "type": "text"}
-                                )
-                        else:
-                            st.session_state["conversations"][-1]["agent_replies"].append(
-                                {"agent": "AiCore", "content": "[AiCore] Error from backend.", "type": "text"}
-                            )
-                    except Exception as exc:
-                        st.session_state["conversations"][-1]["agent_replies"].append(
-                            {"agent": "AiCore", "content": f"[AiCore] Exception: {exc}", "type": "text"}
+                    # (2) Fan out in a background job: AiCore first, then WebAgent and
+                    # GraphAgent in parallel. The script thread returns right away and
+                    # pending_turns polls the job.
+                    total = seq + 1
+                    history = compact_history(get_turns(max(0, total - HISTORY_MAX_TURNS), total))
+                    memo = None
+                    files = selected_files_fingerprint(token, selected_files) if response_cache is not None else None
+                    if files is not None:
+                        memo = AgentMemo(response_cache, conversation_owner(), files, use_cached)
+                    job = AgentJob(get_conversation_store(), conversation_owner(), seq, new_turn)
+                    on_delta = job.on_delta if stream_mode else None
+                    tasks = {
+                        "aicore": (
+                            lambda: call_aicore(client, token, user_input, selected_files, history, on_delta, memo),
+                            []
                         )
-
-                    # (3) Optionally call WebAgent
+                    }
                     if web_mode:
-                        try:
-                            with st.spinner("WebAgent is working..."):
-                                w_payload = {
-                                    "query": user_input,
-                                    "excel_result": aicore_result.get("ExcelAgent", ""),
-                                    "history": st.session_state["conversations"]
-                                }
-                                wresp = requests.post(
-                                    f"{API_BASE}/run_web_agent",
-                                    headers=headers_req,
-                                    json=w_payload,
-                                    timeout=180
-                                )
-                            if wresp.status_code == 200:
-                                web_data = wresp.json()  # {"agent":"WebAgent","result":{...}}
-                                if "result" in web_data:
-                                    web_analysis = web_data["result"].get("openai_analysis", "")
-                                    st.session_state["conversations"][-1]["agent_replies"].append(
-                                        {"agent": "WebAgent", "content": web_analysis, "type": "text"}
-                                    )
-                            else:
-                                st.session_state["conversations"][-1]["agent_replies"].append(
-                                    {"agent": "WebAgent", "content": "[WebAgent] Error from backend.", "type": "text"}
-                                )
-                        except Exception as exc:
-                            st.session_state["conversations"][-1]["agent_replies"].append(
-                                {"agent": "WebAgent", "content": f"[WebAgent] Exception: {exc}", "type": "text"}
-                            )
-
-                    # (4) Optionally call GraphAgent
+                        tasks["web"] = (
+                            lambda aicore: call_web_agent(client, token, user_input, history, aicore, on_delta, memo),
+                            ["aicore"]
+                        )
                     if graph_mode:
-                        graph_payload = {
-                            "query": user_input,
-                            "excel_result": aicore_result.get("ExcelAgent", "")
-                        }
-                        try:
-                            with st.spinner("GraphAgent is working..."):
-                                gresp = requests.post(
-                                    f"{API_BASE}/generate_streamlit_graph",
-                                    headers=headers_req,
-                                    json=graph_payload,
-                                    timeout=180
-                                )
-                            if gresp.status_code == 200:
-                                graph_code = gresp.json().get("code", "")
-                                # Save the actual code in the conversation turn
-                                st.session_state["generated_graph_code"] = graph_code
-                                st.session_state["conversations"][-1]["agent_replies"].append(
-                                    {"agent": "GraphAgent", "content": graph_code, "type": "graph"}
-                                )
-                            else:
-                                st.session_state["conversations"][-1]["agent_replies"].append(
-                                    {"agent": "GraphAgent", "content": "[GraphAgent] Could not generate chart code.", "type": "text"}
-                                )
-                        except Exception as exc:
-                            st.session_state["conversations"][-1]["agent_replies"].append(
-                                {"agent": "GraphAgent", "content": f"[GraphAgent] Exception: {exc}", "type": "text"}
-                            )
-
-                    # Rerun so the partial-typing animation is triggered for the new turn
+                        tasks["graph"] = (
+                            lambda aicore: call_graph_agent(client, token, user_input, aicore, memo, chart_spec_mode),
+                            ["aicore"]
+                        )
+                    job.start(tasks)
+                    st.session_state["agent_jobs"][seq] = job
+
+                    # Rerun so the new turn and its progress panel are shown
                     st.rerun()
 
+            conversation_transfer()
+
             if st.button("Clear Chat"):
-                st.session_state["conversations"] = []
-                st.session_state["rendered_count"] = 0
+                clear_conversation()
                 st.rerun()
 
     else:
@@ -590,4 +3206,5 @@ def main():
 
 # Entry point
 if __name__ == '__main__':
-    main()
+    with rerun_trace():
+        main()
@@ -0,0 +1,325 @@
+"""
+Offline benchmarks for the Streamlit frontend, run against stub_backend.py.
+
+    python benchmark.py --output bench.json
+    python benchmark.py --quick --latency 0.05 --answer-words 400 --output bench.json
+    python benchmark.py --compare baseline.json bench.json
+
+Each scenario drives app.py with Streamlit's AppTest and records rerun
+latency, backend requests and bytes per rerun (as counted by the stub) and
+the process RSS:
+
+    conversation_length  idle reruns and one question on Data Insights for
+                         conversations of increasing length
+    concurrent_sessions  several sessions asking a question at the same time
+
+Results are written as JSON. --compare reports every metric that got worse
+than the baseline by more than --tolerance and exits with status 1 if any did.
+"""
+import argparse
+import json
+import os
+import platform
+import sqlite3
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+import streamlit
+from streamlit.runtime import Runtime
+from streamlit.testing.v1 import AppTest
+
+import stub_backend
+
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "app.py")
+
+# The sidebar option_menu is a custom component that AppTest cannot click, so
+# the page comes from session state instead.
+APP_SCRIPT = f"""
+import runpy
+import sys
+import streamlit as st
+import streamlit_option_menu
+sys.path.insert(0, {os.path.dirname(APP_PATH)!r})
+streamlit_option_menu.option_menu = lambda *args, **kwargs: st.session_state.get("bench_page", "Home")
+runpy.run_path({APP_PATH!r}, run_name="__main__")
+"""
+
+CONVERSATION_LENGTHS = [0, 50, 200, 500]
+SESSION_COUNTS = [1, 4, 8]
+IDLE_RERUNS = 5
+RUN_TIMEOUT = 120
+
+# Metrics where a higher value is a regression, for --compare: every metric whose
+# name contains one of these (first_run_seconds, idle_requests_per_rerun,
+# response_bytes_per_session, ...)
+LOWER_IS_BETTER = (
+    "seconds", "requests", "bytes", "rss_mb",
+)
+
+def rss_mb():
+    """Resident set size of this process (and so of every AppTest session) in MB."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except (OSError, ValueError, AttributeError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def traffic(stats):
+    """Totals of a stub_backend.reset_stats() snapshot."""
+    return {
+        "requests": sum(s["requests"] for s in stats.values()),
+        "request_bytes": sum(s["request_bytes"] for s in stats.values()),
+        "response_bytes": sum(s["response_bytes"] for s in stats.values()),
+    }
+
+def percentile(values, p):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+def seed_conversation(db_path, owner, turns):
+    """Writes `turns` question/answer turns for owner straight into the conversation store."""
+    with sqlite3.connect(db_path) as db:
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS turns ("
+            " owner TEXT NOT NULL, seq INTEGER NOT NULL, turn TEXT NOT NULL,"
+            " PRIMARY KEY (owner, seq))"
+        )
+        db.execute("DELETE FROM turns WHERE owner = ?", (owner,))
+        db.executemany(
+            "INSERT INTO turns (owner, seq, turn) VALUES (?, ?, ?)",
+            [
+                (owner, i, json.dumps({
+                    "user_message": f"Question {i}?",
+                    "agent_replies": [
+                        {"agent": agent, "content": stub_backend.agent_answer(agent, f"Question {i}?"),
+                         "type": "text"}
+                        for agent in ("ExcelAgent", "TextAgent")
+                    ],
+                }))
+                for i in range(turns)
+            ]
+        )
+
+@contextmanager
+def overlapping_runs():
+    """
+    AppTest installs a mock Runtime singleton for each run and clears it when
+    the run ends, which breaks other runs still in flight. While this is
+    active, a cleared singleton falls back to the most recently installed one.
+    """
+    original = Runtime.__dict__["instance"]
+    latest = []
+
+    def instance(cls):
+        if cls._instance is not None:
+            latest[:] = [cls._instance]
+        return cls._instance if cls._instance is not None else latest[0]
+
+    Runtime.instance = classmethod(instance)
+    try:
+        yield
+    finally:
+        Runtime.instance = original
+
+def open_session(username, page="Data Insights"):
+    at = AppTest.from_string(APP_SCRIPT, default_timeout=RUN_TIMEOUT)
+    at.session_state["token"] = stub_backend.STUB_TOKEN
+    at.session_state["username"] = username
+    at.session_state["bench_page"] = page
+    at.run()
+    if at.exception:
+        raise RuntimeError(f"{username}: {at.exception[0].message}")
+    return at
+
+def ask(at, question, graph=False, web=False, stream=False):
+    """
+    Submits one question and returns the seconds until its answers are
+    rendered: the agents run as a background job, so after the submit
+    rerun this waits for the job and reruns once more to show the answers.
+    """
+    wanted = {"Generate Graph with answer?": graph, "Web Cross-Check?": web, "Stream responses?": stream}
+    for checkbox in at.checkbox:
+        if checkbox.label in wanted:
+            checkbox.set_value(wanted[checkbox.label])
+    at.text_input[0].input(question)
+    send = next(b for b in at.button if b.label == "Send")
+    start = time.perf_counter()
+    send.click().run()
+    deadline = start + RUN_TIMEOUT
+    while any(job.status == "running" for job in at.session_state["agent_jobs"].values()):
+        if time.perf_counter() > deadline:
+            raise RuntimeError(f"No answer to {question!r} after {RUN_TIMEOUT} s")
+        time.sleep(0.01)
+    at.run()
+    elapsed = time.perf_counter() - start
+    if at.exception:
+        raise RuntimeError(at.exception[0].message)
+    return elapsed
+
+def conversation_length(lengths, db_path):
+    results = []
+    for turns in lengths:
+        username = f"bench-length-{turns}"
+        seed_conversation(db_path, "user:" + username, turns)
+        stub_backend.reset_stats()
+        start = time.perf_counter()
+        at = open_session(username)
+        first_run = time.perf_counter() - start
+        stub_backend.reset_stats()
+
+        idle = []
+        for _ in range(IDLE_RERUNS):
+            start = time.perf_counter()
+            at.run()
+            idle.append(time.perf_counter() - start)
+        idle_traffic = traffic(stub_backend.reset_stats())
+
+        ask_seconds = ask(at, f"Question {turns}?", graph=True, web=True)
+        ask_traffic = traffic(stub_backend.reset_stats())
+        results.append({
+            "turns": turns,
+            "first_run_seconds": round(first_run, 4),
+            "idle_rerun_p50_seconds": round(statistics.median(idle), 4),
+            "idle_rerun_max_seconds": round(max(idle), 4),
+            "idle_requests_per_rerun": idle_traffic["requests"] / IDLE_RERUNS,
+            "idle_response_bytes_per_rerun": idle_traffic["response_bytes"] / IDLE_RERUNS,
+            "ask_seconds": round(ask_seconds, 4),
+            "ask_requests": ask_traffic["requests"],
+            "ask_request_bytes": ask_traffic["request_bytes"],
+            "ask_response_bytes": ask_traffic["response_bytes"],
+            "rss_mb": round(rss_mb(), 1),
+        })
+        print(f"conversation_length {results[-1]}", file=sys.stderr)
+    return results
+
+def concurrent_sessions(counts, stream):
+    results = []
+    for count in counts:
+        sessions = [open_session(f"bench-concurrent-{count}-{i}") for i in range(count)]
+        stub_backend.reset_stats()
+        latencies = [None] * count
+        errors = []
+
+        def worker(i):
+            try:
+                latencies[i] = ask(sessions[i], f"Session {i} question?", web=True, stream=stream)
+            except Exception as e:
+                errors.append(repr(e))
+
+        with overlapping_runs():
+            start = time.perf_counter()
+            threads = [threading.Thread(target=worker, args=(i,)) for i in range(count)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            wall = time.perf_counter() - start
+        if errors:
+            raise RuntimeError(f"{len(errors)} sessions failed: {errors[0]}")
+        totals = traffic(stub_backend.reset_stats())
+        results.append({
+            "sessions": count,
+            "wall_seconds": round(wall, 4),
+            "ask_p50_seconds": round(statistics.median(latencies), 4),
+            "ask_p95_seconds": round(percentile(latencies, 95), 4),
+            "requests_per_session": totals["requests"] / count,
+            "request_bytes_per_session": totals["request_bytes"] / count,
+            "response_bytes_per_session": totals["response_bytes"] / count,
+            "rss_mb": round(rss_mb(), 1),
+        })
+        print(f"concurrent_sessions {results[-1]}", file=sys.stderr)
+    return results
+
+def run(args):
+    server = stub_backend.serve(
+        port=0, latency=args.latency, token_delay=args.token_delay, processing_seconds=0,
+        answer_words=args.answer_words, streaming=not args.no_stream
+    )
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    workdir = tempfile.mkdtemp(prefix="razonica-bench-")
+    db_path = os.path.join(workdir, "conversations.sqlite")
+    os.environ["RAZONICA_API_BASE"] = f"http://127.0.0.1:{server.server_address[1]}"
+    os.environ["RAZONICA_CONVERSATION_DB"] = db_path
+    # Every question should reach the stub
+    os.environ.pop("RAZONICA_RESPONSE_CACHE", None)
+
+    lengths = CONVERSATION_LENGTHS[:3] if args.quick else CONVERSATION_LENGTHS
+    counts = SESSION_COUNTS[:2] if args.quick else SESSION_COUNTS
+    try:
+        return {
+            "meta": {
+                "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+                "python": platform.python_version(),
+                "streamlit": streamlit.__version__,
+                "platform": platform.platform(),
+                "stub": {
+                    "latency": args.latency,
+                    "token_delay": args.token_delay,
+                    "answer_words": args.answer_words,
+                    "streaming": not args.no_stream,
+                },
+            },
+            "scenarios": {
+                "conversation_length": conversation_length(lengths, db_path),
+                "concurrent_sessions": concurrent_sessions(counts, stream=not args.no_stream),
+            },
+        }
+    finally:
+        server.shutdown()
+
+def compare(baseline, current, tolerance):
+    """Lines describing metrics that regressed by more than `tolerance` (a fraction)."""
+    regressions = []
+    for scenario, rows in current["scenarios"].items():
+        base_rows = baseline.get("scenarios", {}).get(scenario, [])
+        for row in rows:
+            # Rows are matched on their first key (turns, sessions)
+            param = next(iter(row))
+            base = next((b for b in base_rows if b.get(param) == row[param]), None)
+            if base is None:
+                continue
+            for metric, value in row.items():
+                if metric == param or metric not in base or not any(w in metric for w in LOWER_IS_BETTER):
+                    continue
+                old = base[metric]
+                if value > old * (1 + tolerance) and value - old > 1e-3:
+                    change = f"+{(value / old - 1) * 100:.0f}%" if old else "new"
+                    regressions.append(f"{scenario}[{param}={row[param]}] {metric}: {old} -> {value} ({change})")
+    return regressions
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline frontend benchmarks against the stub backend")
+    parser.add_argument("--output", help="File for the JSON results (default: stdout)")
+    parser.add_argument("--quick", action="store_true", help="Fewer and smaller scenarios")
+    parser.add_argument("--latency", type=float, default=0.0, help="Stub latency per request, in seconds")
+    parser.add_argument("--token-delay", type=float, default=0.002, help="Stub seconds between streamed tokens")
+    parser.add_argument("--answer-words", type=int, default=0, help="Filler words added to every stub answer")
+    parser.add_argument("--no-stream", action="store_true", help="Stub answers with plain JSON only")
+    parser.add_argument("--compare", nargs=2, metavar=("BASELINE", "CURRENT"),
+                        help="Compare two result files instead of running")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="Allowed relative regression for --compare (default 0.2)")
+    args = parser.parse_args()
+
+    if args.compare:
+        with open(args.compare[0]) as f:
+            baseline = json.load(f)
+        with open(args.compare[1]) as f:
+            current = json.load(f)
+        regressions = compare(baseline, current, args.tolerance)
+        for line in regressions:
+            print(line)
+        print(f"{len(regressions)} regressions beyond {args.tolerance:.0%}")
+        sys.exit(1 if regressions else 0)
+
+    results = json.dumps(run(args), indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(results + "\n")
+    else:
+        print(results)
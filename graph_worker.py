@@ -0,0 +1,229 @@
+"""
+Isolated execution of GraphAgent chart code.
+
+These functions run inside the worker processes of the graph pool created in
+app.py, never in the Streamlit server process, which only imports this module
+for the function references and so never loads matplotlib itself. Each
+worker loads matplotlib with the Agg backend, caps its address space at start-up and
+bounds every snippet by CPU time and wall-clock time. The output is a list
+of picklable records that the UI replays:
+
+    ("image", png_bytes)
+    ("spec", vega_lite_spec)      # chart-spec mode, for figures figure_to_spec understands
+    ("call", st_method_name, args, kwargs)
+    ("error", message)
+    ("limit", message)            # CPU, wall-clock or memory limit hit; shown as an error, never cached
+"""
+import builtins
+import gc
+import io
+import signal
+
+try:
+    import resource
+except ImportError:  # Windows: no rlimits, only the wall-clock timeout in app.py applies
+    resource = None
+
+class GraphLimitExceeded(Exception):
+    pass
+
+class StreamlitRecorder:
+    """
+    Stand-in for the `st` module while GraphAgent code runs. Figures passed
+    to st.pyplot are rasterized to PNG and chart/display calls are recorded
+    so the UI can replay them. Layout and widget calls are not supported.
+    """
+    RECORDED = {
+        "line_chart", "bar_chart", "area_chart", "scatter_chart", "map",
+        "altair_chart", "vega_lite_chart", "plotly_chart", "pydeck_chart",
+        "dataframe", "table", "metric", "json", "image",
+        "write", "markdown", "text", "caption", "title", "header", "subheader",
+    }
+
+    def __init__(self, chart_spec=False):
+        self.outputs = []
+        self.chart_spec = chart_spec
+
+    def pyplot(self, fig=None, **kwargs):
+        import matplotlib.pyplot as plt
+        fig = fig if fig is not None else plt.gcf()
+        spec = figure_to_spec(fig) if self.chart_spec else None
+        if spec is not None:
+            plt.close(fig)
+            self.outputs.append(("spec", spec))
+            return
+        buf = io.BytesIO()
+        fig.savefig(buf, format="png", bbox_inches="tight")
+        plt.close(fig)
+        self.outputs.append(("image", buf.getvalue()))
+
+    def __getattr__(self, name):
+        if name in self.RECORDED:
+            return lambda *args, **kwargs: self.outputs.append(("call", name, args, kwargs))
+        raise AttributeError(f"st.{name} is not supported in generated chart code")
+
+def _axis_values(values):
+    """(JSON-ready list, Vega-Lite type) for one axis of plotted data."""
+    import numpy as np
+    array = np.asarray(values)
+    if array.dtype.kind in "biuf":
+        return array.astype(float).tolist(), "quantitative"
+    if array.dtype.kind == "M":
+        return np.datetime_as_string(array, unit="ms").tolist(), "temporal"
+    try:
+        return np.datetime_as_string(array.astype("datetime64[ms]"), unit="ms").tolist(), "temporal"
+    except (TypeError, ValueError):
+        return [str(v) for v in array.tolist()], "nominal"
+
+def _series_name(artist, i):
+    label = artist.get_label()
+    return label if label and not label.startswith("_") else f"series {i + 1}"
+
+def figure_to_spec(fig):
+    """
+    Vega-Lite spec for a figure with a single axes holding only lines, only
+    bars or only scatter points; None for anything else, which is rendered
+    as an image instead.
+    """
+    from matplotlib.category import StrCategoryFormatter
+    from matplotlib.collections import PathCollection
+    from matplotlib.container import BarContainer
+
+    axes = fig.get_axes()
+    if len(axes) != 1:
+        return None
+    ax = axes[0]
+    lines = ax.get_lines()
+    bars = [c for c in ax.containers if isinstance(c, BarContainer)]
+    points = [c for c in ax.collections if isinstance(c, PathCollection)]
+    if sum(map(bool, (lines, bars, points))) != 1 or len(ax.collections) != len(points) or ax.images:
+        return None
+
+    rows = []
+    x_type = "quantitative"
+    if lines:
+        mark = "line"
+        for i, line in enumerate(lines):
+            xs, x_type = _axis_values(line.get_xdata(orig=True))
+            ys, _ = _axis_values(line.get_ydata(orig=True))
+            rows += [{"x": x, "y": y, "series": _series_name(line, i)} for x, y in zip(xs, ys)]
+    elif bars:
+        mark = "bar"
+        if any(abs(bar.get_y()) > 1e-12 for c in bars for bar in c):
+            return None  # stacked, offset or horizontal bars
+        categorical = isinstance(ax.xaxis.get_major_formatter(), StrCategoryFormatter)
+        formatter = ax.xaxis.get_major_formatter()
+        x_type = "nominal" if categorical else "quantitative"
+        for i, container in enumerate(bars):
+            for bar in container:
+                center = bar.get_x() + bar.get_width() / 2
+                rows.append({
+                    "x": formatter(center) if categorical else center,
+                    "y": float(bar.get_height()),
+                    "series": _series_name(container, i),
+                })
+    else:
+        mark = "point"
+        for i, collection in enumerate(points):
+            for x, y in collection.get_offsets().tolist():
+                rows.append({"x": x, "y": y, "series": _series_name(collection, i)})
+
+    encoding = {
+        "x": {"field": "x", "type": x_type, "title": ax.get_xlabel() or None},
+        "y": {"field": "y", "type": "quantitative", "title": ax.get_ylabel() or None},
+    }
+    if x_type == "nominal":
+        encoding["x"]["sort"] = None  # keep the plotted order
+    if len({row["series"] for row in rows}) > 1:
+        encoding["color"] = {"field": "series", "type": "nominal", "title": None}
+        if mark == "bar":
+            encoding["xOffset"] = {"field": "series"}
+    spec = {
+        "data": {"values": rows},
+        "mark": {"type": mark, "tooltip": True},
+        "encoding": encoding,
+    }
+    if ax.get_title():
+        spec["title"] = ax.get_title()
+    return spec
+
+def _raise_cpu_limit(signum, frame):
+    raise GraphLimitExceeded("CPU time limit exceeded")
+
+def _raise_wall_limit(signum, frame):
+    raise GraphLimitExceeded("Time limit exceeded")
+
+def _vm_size():
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmSize:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return 0
+
+def init_worker(max_memory_bytes):
+    """
+    Pool initializer: loads matplotlib (already imported when the forkserver
+    preloaded it), installs limit handlers and caps memory above the warm baseline.
+    """
+    import graph_worker_env  # noqa: F401  (before numpy and matplotlib load)
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot
+    if resource is None:
+        return
+    signal.signal(signal.SIGXCPU, _raise_cpu_limit)
+    signal.signal(signal.SIGALRM, _raise_wall_limit)
+    if max_memory_bytes:
+        limit = _vm_size() + max_memory_bytes
+        _, hard = resource.getrlimit(resource.RLIMIT_AS)
+        if hard != resource.RLIM_INFINITY:
+            limit = min(limit, hard)
+        resource.setrlimit(resource.RLIMIT_AS, (limit, hard))
+
+def _cpu_used():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+def run_graph_code(code, cpu_seconds, wall_seconds, chart_spec=False):
+    """Executes one snippet in a fresh namespace and returns its output records."""
+    import matplotlib.pyplot as plt
+    recorder = StreamlitRecorder(chart_spec)
+
+    def graph_import(name, *args, **kwargs):
+        if name == "streamlit":
+            return recorder
+        return builtins.__import__(name, *args, **kwargs)
+
+    namespace = {
+        "__builtins__": dict(vars(builtins), __import__=graph_import),
+        "__name__": "graph_agent",
+        "st": recorder,
+        "plt": plt,
+    }
+    if resource is not None:
+        # RLIMIT_CPU counts the whole process, so move the soft limit past what
+        # earlier snippets used. The hard limit stays untouched so it can be raised again.
+        _, cpu_hard = resource.getrlimit(resource.RLIMIT_CPU)
+        resource.setrlimit(resource.RLIMIT_CPU, (int(_cpu_used()) + 1 + int(cpu_seconds), cpu_hard))
+        signal.setitimer(signal.ITIMER_REAL, wall_seconds)
+    try:
+        exec(code, namespace)
+    except MemoryError:
+        recorder.outputs.append(("limit", "Memory limit exceeded"))
+    except GraphLimitExceeded as e:
+        recorder.outputs.append(("limit", str(e)))
+    except Exception as e:
+        recorder.outputs.append(("error", str(e)))
+    finally:
+        if resource is not None:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+            resource.setrlimit(resource.RLIMIT_CPU, (cpu_hard, cpu_hard))
+        # Figures the snippet created but never passed to st.pyplot are closed
+        # here; figures hold reference cycles, so collect them right away
+        plt.close("all")
+        namespace.clear()
+        gc.collect()
+    return recorder.outputs
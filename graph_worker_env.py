@@ -0,0 +1,13 @@
+"""
+Environment of the graph worker processes (see graph_worker.py).
+
+Preloaded first by the graph pool's forkserver, and imported by
+graph_worker.init_worker in spawned workers, so these settings apply before
+numpy and matplotlib load without changing the environment of the Streamlit
+server process.
+"""
+import os
+
+# Keep BLAS from reserving per-thread arenas before the memory cap applies
+os.environ.setdefault("OPENBLAS_NUM_THREADS", "1")
+os.environ.setdefault("MPLBACKEND", "Agg")
@@ -0,0 +1,32 @@
+"""
+State that app.py shares across reruns.
+
+Streamlit re-executes app.py as a fresh __main__ module on every rerun, while
+objects created through st.cache_resource (the backend client, its pools and
+their threads) keep running the code of the rerun that created them. Module
+globals of app.py, ContextVars included, are therefore different objects in
+every rerun: a value set by a later rerun is invisible to the cached objects.
+Anything that has to be seen by both lives here, in a module that is imported
+once per process.
+"""
+import contextvars
+
+# Registries for the current session and the current rerun. Set by rerun_trace on
+# the script thread and carried into agent worker threads by run_agent_tasks.
+session_perf = contextvars.ContextVar("session_perf", default=None)
+rerun_perf = contextvars.ContextVar("rerun_perf", default=None)
+
+# Session a backend request is made for, so backend admission can be fair across
+# sessions. Set for agent worker threads by run_agent_tasks; on the script thread
+# the script run context is used (see app.current_session_id).
+request_session = contextvars.ContextVar("request_session", default=None)
+
+# Agent job a backend request is made for (see app.AgentJob), so cancelling the
+# job can abort the request's connection
+current_job = contextvars.ContextVar("current_job", default=None)
+
+# Deadline of the question a backend request is made for, set by AgentJob.start
+deadline = contextvars.ContextVar("deadline", default=None)
+
+# time.monotonic() of the last metrics file export, for all sessions
+last_metrics_export = [0.0]
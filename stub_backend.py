@@ -0,0 +1,425 @@
+"""
+Local stand-in for the Razonica backend, for exercising the frontend offline.
+
+    python stub_backend.py --port 8765
+    RAZONICA_API_BASE=http://127.0.0.1:8765 streamlit run app.py
+
+Agent endpoints answer with a chunked text/event-stream when the request
+sends `Accept: text/event-stream`, and with the regular JSON body otherwise.
+/generate_streamlit_graph returns a Vega-Lite spec instead of chart code
+when the request asks for `"chart_format": "vega-lite"`.
+A fraction of agent requests (--slow-rate) can be delayed by --slow-seconds
+to give them a latency tail; the X-Request-Deadline-Ms header is honoured by
+answering 504 once it passes.
+/delete_uploads and /reprocess_uploads act on {"upload_ids": [...]} at once
+unless --no-batch is given, in which case they answer 404 like a backend
+with only the per-file /delete_upload and /reprocess_upload endpoints.
+/upload accepts the Dropzone chunk fields (dzuuid, dzchunkindex, ...) and
+/upload_status reports which chunks of an upload are already stored, unless
+--no-chunking is given: then /upload_status answers 404 and /upload only
+takes whole files, like a backend without chunked uploads.
+Requests are counted per endpoint in STATS (see reset_stats), which the
+benchmarks in benchmark.py read.
+"""
+import argparse
+import gzip
+import hashlib
+import json
+import math
+import random
+import sys
+import threading
+import time
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+STUB_TOKEN = "stub-token"
+
+STUB_FILES = [
+    {"id": 1, "filename": "sales_2024.xlsx", "status": "completed"},
+    {"id": 2, "filename": "inventory.csv", "status": "completed"},
+    {"id": 3, "filename": "notes.pdf", "status": "processing"},
+]
+STARTED_AT = time.monotonic()
+HASH_BLOCK = 8 * 1024 * 1024
+# Chunks received so far, by upload id: {upload_id: {chunk_index: bytes}}
+UPLOAD_CHUNKS = {}
+STATE_LOCK = threading.Lock()
+# Per-endpoint traffic: {"METHOD /path": {"requests", "request_bytes", "response_bytes"}}
+STATS = {}
+
+def content_hash(data):
+    """Same scheme as the Dropzone uploader: SHA-256 over the digests of 8 MB blocks."""
+    digests = b"".join(
+        hashlib.sha256(data[i:i + HASH_BLOCK]).digest() for i in range(0, len(data), HASH_BLOCK)
+    )
+    return hashlib.sha256(digests).hexdigest()
+
+def parse_multipart(content_type, body):
+    """Form fields of a multipart/form-data body as ({name: bytes}, {name: filename})."""
+    message = BytesParser(policy=HTTP).parsebytes(
+        b"Content-Type: " + content_type.encode() + b"\r\n\r\n" + body
+    )
+    fields, filenames = {}, {}
+    for part in message.iter_parts():
+        name = part.get_param("name", header="content-disposition")
+        fields[name] = part.get_payload(decode=True)
+        if part.get_filename():
+            filenames[name] = part.get_filename()
+    return fields, filenames
+
+def reset_stats():
+    """Returns the traffic counted so far and starts counting from zero."""
+    with STATE_LOCK:
+        stats = {endpoint: dict(counts) for endpoint, counts in STATS.items()}
+        STATS.clear()
+    return stats
+
+def chart_spec(points):
+    """Vega-Lite line chart of two daily series with `points` rows each."""
+    values = [
+        {"day": i, "revenue": round(100 + 40 * math.sin(i / 50) + random.gauss(0, 5), 2), "series": name}
+        for name in ("Revenue", "Forecast")
+        for i in range(points)
+    ]
+    return {
+        "data": {"values": values},
+        "mark": "line",
+        "encoding": {
+            "x": {"field": "day", "type": "quantitative"},
+            "y": {"field": "revenue", "type": "quantitative"},
+            "color": {"field": "series", "type": "nominal"},
+        },
+    }
+
+def list_files(processing_seconds):
+    """
+    STUB_FILES, with 'processing' files completing processing_seconds after
+    start-up or after they were last reprocessed.
+    """
+    now = time.monotonic()
+    with STATE_LOCK:
+        files = [dict(f) for f in STUB_FILES]
+    for f in files:
+        since = f.pop("processing_since", STARTED_AT)
+        if f["status"] == "processing" and now - since >= processing_seconds:
+            f["status"] = "completed"
+    return files
+
+def file_action(action, upload_id):
+    """Deletes or reprocesses one stub file; returns a per-file result record."""
+    with STATE_LOCK:
+        match = [f for f in STUB_FILES if f["id"] == upload_id]
+        if not match:
+            return {"upload_id": upload_id, "success": False, "message": "No such upload"}
+        if action == "delete":
+            STUB_FILES.remove(match[0])
+        else:
+            match[0].update(status="processing", processing_since=time.monotonic())
+    return {"upload_id": upload_id, "success": True}
+
+FILLER_WORDS = "revenue grew steadily across all four quarters with Q4 the strongest".split()
+
+def agent_answer(agent, query, words=0):
+    """Canned answer, padded with filler to `words` extra words to vary the payload size."""
+    filler = " ".join(FILLER_WORDS[i % len(FILLER_WORDS)] for i in range(words))
+    return (
+        f"{agent} stub answer for '{query}'. "
+        "Revenue grew steadily across all four quarters, with Q4 the strongest."
+        + (" " + filler if filler else "")
+    )
+
+def table_answer(rows):
+    """Markdown table of `rows` rows, the way ExcelAgent reports sheet extracts."""
+    lines = ["| Region | Quarter | Revenue | Units |", "|---|---|---:|---:|"]
+    regions = ["North", "South", "East", "West"]
+    for i in range(rows):
+        lines.append(f"| {regions[i % 4]} | Q{i // 4 % 4 + 1} | {1000 + i * 37.5:.2f} | {10 + i % 90} |")
+    return "\n\nSheet extract:\n\n" + "\n".join(lines)
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Overridden from the command line
+    latency = 0.0
+    token_delay = 0.02
+    processing_seconds = 20.0
+    upload_fail_rate = 0.0
+    answer_words = 0
+    streaming = True
+    chart_points = 5000
+    table_rows = 0
+    slow_rate = 0.0
+    slow_seconds = 5.0
+    batch = True
+    chunking = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def _count(self, request_bytes=0, response_bytes=0, new_request=False):
+        endpoint = self.command + " " + urlsplit(self.path).path
+        with STATE_LOCK:
+            counts = STATS.setdefault(endpoint, {"requests": 0, "request_bytes": 0, "response_bytes": 0})
+            counts["requests"] += int(new_request)
+            counts["request_bytes"] += request_bytes
+            counts["response_bytes"] += response_bytes
+
+    def send_response(self, code, message=None):
+        self._count(request_bytes=int(self.headers.get("Content-Length") or 0), new_request=True)
+        super().send_response(code, message)
+
+    # ---------------------------
+    # Response helpers
+    # ---------------------------
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        if not length:
+            return {}
+        body = self.rfile.read(length)
+        if self.headers.get("Content-Encoding") == "gzip":
+            body = gzip.decompress(body)
+        return json.loads(body)
+
+    def end_headers(self):
+        # The Dropzone iframe calls the stub directly from the browser
+        self.send_header("Access-Control-Allow-Origin", "*")
+        self.send_header("Access-Control-Allow-Headers",
+                         "Authorization, Content-Type, Content-Encoding, If-None-Match, If-Modified-Since")
+        self.send_header("Access-Control-Allow-Methods", "GET, POST, OPTIONS")
+        self.send_header("Access-Control-Expose-Headers", "ETag")
+        super().end_headers()
+
+    def _send_json(self, body, status=200):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+        self._count(response_bytes=len(data))
+
+    def _send_json_conditional(self, body):
+        """JSON response with an ETag, answering 304 when If-None-Match matches."""
+        data = json.dumps(body).encode()
+        etag = '"' + hashlib.sha1(data).hexdigest() + '"'
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.send_header("ETag", etag)
+        self.end_headers()
+        self.wfile.write(data)
+        self._count(response_bytes=len(data))
+
+    def _write_chunk(self, data):
+        self.wfile.write(f"{len(data):X}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+        self._count(response_bytes=len(data))
+
+    def _send_event_stream(self, pieces, body):
+        """Streams (agent, text) pieces word by word, then the final JSON body."""
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        for agent, text in pieces:
+            for word in text.split(" "):
+                event = {"agent": agent, "delta": word + " "}
+                self._write_chunk(f"data: {json.dumps(event)}\n\n".encode())
+                time.sleep(self.token_delay)
+        self._write_chunk(f"data: {json.dumps({'body': body})}\n\n".encode())
+        self._write_chunk(b"data: [DONE]\n\n")
+        self._write_chunk(b"")
+
+    def _wants_stream(self):
+        return self.streaming and "text/event-stream" in self.headers.get("Accept", "")
+
+    def _authorized(self):
+        return self.headers.get("Authorization") == "Bearer " + STUB_TOKEN
+
+    # ---------------------------
+    # Routes
+    # ---------------------------
+    def do_OPTIONS(self):
+        self.send_response(204)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_GET(self):
+        time.sleep(self.latency)
+        if not self._authorized():
+            return self._send_json({"message": "Unauthorized"}, 401)
+        url = urlsplit(self.path)
+        if url.path == "/upload_status" and self.chunking:
+            upload_id = parse_qs(url.query).get("upload_id", [""])[0]
+            with STATE_LOCK:
+                received = sorted(UPLOAD_CHUNKS.get(upload_id, {}))
+            return self._send_json({"upload_id": upload_id, "received": received})
+        if self.path == "/list_uploaded_files":
+            return self._send_json_conditional({"files": list_files(self.processing_seconds)})
+        if self.path == "/get_user_files":
+            files = list_files(self.processing_seconds)
+            return self._send_json({"files": [f["filename"] for f in files if f["status"] == "completed"]})
+        self._send_json({"message": "Not found"}, 404)
+
+    def _upload_chunk(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        fields, filenames = parse_multipart(self.headers.get("Content-Type", ""), self.rfile.read(length))
+        if random.random() < self.upload_fail_rate:
+            return self._send_json({"message": "Simulated dropped chunk"}, 503)
+        data = fields.get("file") or b""
+        if "dzuuid" in fields and not self.chunking:
+            return self._send_json({"message": "Chunked uploads are not supported"}, 400)
+        if "dzuuid" not in fields:
+            # Plain single-request upload
+            chunks = {0: data}
+            total = 1
+        else:
+            upload_id = fields["dzuuid"].decode()
+            total = int(fields["dztotalchunkcount"])
+            with STATE_LOCK:
+                chunks = UPLOAD_CHUNKS.setdefault(upload_id, {})
+                chunks[int(fields["dzchunkindex"])] = data
+                chunks = dict(chunks)
+        if len(chunks) < total:
+            return self._send_json({"success": True, "received": len(chunks)})
+        whole = b"".join(chunks[i] for i in range(total))
+        with STATE_LOCK:
+            if "dzuuid" in fields:
+                UPLOAD_CHUNKS.pop(fields["dzuuid"].decode(), None)
+            STUB_FILES.append({
+                "id": max((f["id"] for f in STUB_FILES), default=0) + 1,
+                "filename": filenames.get("file", "upload.bin"),
+                "status": "processing",
+                "sha256": content_hash(whole),
+                "size": len(whole),
+            })
+        return self._send_json({"success": True, "completed": True})
+
+    def do_POST(self):
+        time.sleep(self.latency)
+        if self.path == "/upload":
+            if not self._authorized():
+                return self._send_json({"message": "Unauthorized"}, 401)
+            return self._upload_chunk()
+        payload = self._read_json()
+        if self.path == "/login":
+            return self._send_json({"token": STUB_TOKEN})
+        if self.path == "/register":
+            return self._send_json({"message": "Registered"}, 201)
+        if not self._authorized():
+            return self._send_json({"message": "Unauthorized"}, 401)
+
+        query = payload.get("query", "")
+        if self.path in ("/run_aicore", "/run_web_agent", "/generate_streamlit_graph") and self.slow_rate:
+            delay = self.slow_seconds if random.random() < self.slow_rate else 0.0
+            deadline = int(self.headers.get("X-Request-Deadline-Ms") or 0) / 1000
+            if deadline and delay > deadline:
+                time.sleep(deadline)
+                return self._send_json({"message": "Deadline exceeded"}, 504)
+            time.sleep(delay)
+        if self.path == "/run_aicore":
+            body = {
+                "ExcelAgent": agent_answer("ExcelAgent", query, self.answer_words)
+                              + (table_answer(self.table_rows) if self.table_rows else ""),
+                "TextAgent": agent_answer("TextAgent", query, self.answer_words),
+            }
+            if self._wants_stream():
+                return self._send_event_stream(list(body.items()), body)
+            return self._send_json(body)
+        if self.path == "/run_web_agent":
+            analysis = agent_answer("WebAgent", query, self.answer_words)
+            body = {"agent": "WebAgent", "result": {"openai_analysis": analysis}}
+            if self._wants_stream():
+                return self._send_event_stream([("WebAgent", analysis)], body)
+            return self._send_json(body)
+        if self.path == "/generate_streamlit_graph":
+            if payload.get("chart_format") == "vega-lite":
+                return self._send_json({"spec": chart_spec(self.chart_points)})
+            code = (
+                "import matplotlib.pyplot as plt\n"
+                "fig, ax = plt.subplots()\n"
+                "ax.bar(['Q1', 'Q2', 'Q3', 'Q4'], [3, 5, 6, 9])\n"
+                "st.pyplot(fig)\n"
+            )
+            return self._send_json({"code": code})
+        if self.path == "/reprocess_upload":
+            result = file_action("reprocess", payload.get("upload_id"))
+            return self._send_json(result, 200 if result["success"] else 404)
+        if self.path in ("/delete_uploads", "/reprocess_uploads") and self.batch:
+            action = "delete" if self.path == "/delete_uploads" else "reprocess"
+            return self._send_json({"results": [file_action(action, i) for i in payload.get("upload_ids", [])]})
+        if self.path in ("/delete_upload", "/delete"):
+            with STATE_LOCK:
+                STUB_FILES[:] = [
+                    f for f in STUB_FILES
+                    if f["id"] != payload.get("upload_id") and f["filename"] != payload.get("filename")
+                ]
+            return self._send_json({"success": True})
+        self._send_json({"message": "Not found"}, 404)
+
+class StubServer(ThreadingHTTPServer):
+    def handle_error(self, request, client_address):
+        # Streaming clients may hang up right after the [DONE] event
+        if not isinstance(sys.exc_info()[1], (BrokenPipeError, ConnectionResetError)):
+            super().handle_error(request, client_address)
+
+def serve(host="127.0.0.1", port=8765, latency=0.0, token_delay=0.02, processing_seconds=20.0,
+          upload_fail_rate=0.0, answer_words=0, streaming=True, chart_points=5000,
+          table_rows=0, slow_rate=0.0, slow_seconds=5.0, batch=True, chunking=True):
+    StubHandler.upload_fail_rate = upload_fail_rate
+    StubHandler.answer_words = answer_words
+    StubHandler.streaming = streaming
+    StubHandler.chart_points = chart_points
+    StubHandler.table_rows = table_rows
+    StubHandler.slow_rate = slow_rate
+    StubHandler.slow_seconds = slow_seconds
+    StubHandler.batch = batch
+    StubHandler.chunking = chunking
+    StubHandler.latency = latency
+    StubHandler.token_delay = token_delay
+    StubHandler.processing_seconds = processing_seconds
+    server = StubServer((host, port), StubHandler)
+    server.daemon_threads = True
+    return server
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stub Razonica backend")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added before every response")
+    parser.add_argument("--token-delay", type=float, default=0.02, help="Seconds between streamed tokens")
+    parser.add_argument("--processing-seconds", type=float, default=20.0,
+                        help="Seconds until 'processing' uploads report 'completed'")
+    parser.add_argument("--upload-fail-rate", type=float, default=0.0,
+                        help="Fraction of upload chunks answered with 503, to exercise resume")
+    parser.add_argument("--answer-words", type=int, default=0,
+                        help="Filler words added to every agent answer, to vary payload sizes")
+    parser.add_argument("--no-stream", action="store_true",
+                        help="Answer agent requests with plain JSON even when streaming is requested")
+    parser.add_argument("--chart-points", type=int, default=5000,
+                        help="Rows per series in the chart specs returned for chart_format=vega-lite")
+    parser.add_argument("--table-rows", type=int, default=0,
+                        help="Rows of a markdown table appended to ExcelAgent answers")
+    parser.add_argument("--slow-rate", type=float, default=0.0,
+                        help="Fraction of agent requests delayed by --slow-seconds, to exercise hedging")
+    parser.add_argument("--slow-seconds", type=float, default=5.0)
+    parser.add_argument("--no-batch", action="store_true",
+                        help="Answer the batch file endpoints with 404, to exercise the per-file fallback")
+    parser.add_argument("--no-chunking", action="store_true",
+                        help="Reject chunked uploads and answer /upload_status with 404")
+    args = parser.parse_args()
+    server = serve(args.host, args.port, args.latency, args.token_delay, args.processing_seconds,
+                   args.upload_fail_rate, args.answer_words, not args.no_stream, args.chart_points,
+                   args.table_rows, args.slow_rate, args.slow_seconds, not args.no_batch,
+                   not args.no_chunking)
+    print(f"Stub backend listening on http://{args.host}:{args.port}")
+    server.serve_forever()
@@ -0,0 +1,23 @@
+import os
+import sys
+import threading
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import stub_backend
+
+@pytest.fixture(scope="session")
+def backend(tmp_path_factory):
+    """
+    stub_backend.py serving the app for the whole test session: the app's
+    backend client is cached per process, so every test shares one server.
+    """
+    server = stub_backend.serve(port=0, processing_seconds=0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    os.environ["RAZONICA_API_BASE"] = f"http://127.0.0.1:{server.server_address[1]}"
+    os.environ["RAZONICA_CONVERSATION_DB"] = str(tmp_path_factory.mktemp("db") / "conversations.sqlite")
+    os.environ.pop("RAZONICA_RESPONSE_CACHE", None)
+    yield server
+    server.shutdown()
@@ -0,0 +1,58 @@
+import time
+
+import stub_backend
+from benchmark import ask, open_session
+
+def wait_for(predicate, timeout=10):
+    end = time.monotonic() + timeout
+    while time.monotonic() < end:
+        result = predicate()
+        if result:
+            return result
+        time.sleep(0.02)
+    return predicate()
+
+def test_cancel_aborts_request_of_job_started_in_a_later_rerun(backend, monkeypatch):
+    # The first run creates the cached backend client; the job starts in a later
+    # rerun, which runs a fresh copy of app.py
+    at = open_session("test-cancel")
+    at.run()
+    monkeypatch.setattr(stub_backend.StubHandler, "slow_rate", 1.0)
+    monkeypatch.setattr(stub_backend.StubHandler, "slow_seconds", 30.0)
+    at.text_input[0].input("Slow question?")
+    next(b for b in at.button if b.label == "Send").click().run()
+    (job,) = at.session_state["agent_jobs"].values()
+    connections = wait_for(lambda: list(job._connections))
+    assert connections, "the agent request was not tracked by its job"
+
+    start = time.monotonic()
+    next(b for b in at.button if b.label == "Cancel").click().run()
+    assert wait_for(lambda: all(c.sock is None for c in connections), timeout=5)
+    assert time.monotonic() - start < 5
+    assert job.status == "cancelled"
+
+def test_question_deadline_bounds_agent_calls_in_a_later_rerun(backend, monkeypatch):
+    at = open_session("test-deadline")
+    at.run()
+    monkeypatch.setenv("RAZONICA_QUESTION_DEADLINE", "1")
+    monkeypatch.setattr(stub_backend.StubHandler, "slow_rate", 1.0)
+    monkeypatch.setattr(stub_backend.StubHandler, "slow_seconds", 30.0)
+    # The stub answers 504 once X-Request-Deadline-Ms has passed
+    assert ask(at, "Slow question?") < 5
+
+def test_finished_job_animates_only_its_replies(backend, monkeypatch):
+    monkeypatch.setenv("RAZONICA_PERF", "1")
+    at = open_session("test-animate")
+    at.run()
+    monkeypatch.setattr(stub_backend.StubHandler, "latency", 1.0)
+    animations = lambda: at.session_state["perf"].timers.get(("animate_text", ""), {"count": 0})["count"]
+    at.text_input[0].input("Question?")
+    next(b for b in at.button if b.label == "Send").click().run()
+    assert animations() == 1  # the user message
+    (job,) = at.session_state["agent_jobs"].values()
+    assert wait_for(lambda: job.status != "running")
+    at.run()
+    replies = at.session_state["conversations"][-1]["agent_replies"]
+    assert replies and animations() == 1 + len(replies)
+    at.run()
+    assert animations() == 1 + len(replies)
@@ -0,0 +1,80 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+import requests
+
+import app
+import stub_backend
+
+
+def wait_for(predicate, timeout=5):
+    end = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < end, "condition not reached"
+        time.sleep(0.005)
+
+
+def queued(limiter):
+    with limiter._cond:
+        return sum(len(tickets) for tickets in limiter._queues.values())
+
+
+def test_fair_limiter_admits_sessions_round_robin():
+    limiter = app.FairLimiter(1)
+    limiter.acquire("holder")
+    admitted = []
+    threads = []
+    for i, session in enumerate("AAAABB"):
+        thread = threading.Thread(target=lambda s=session: (limiter.acquire(s, timeout=5), admitted.append(s)))
+        thread.start()
+        threads.append(thread)
+        wait_for(lambda: queued(limiter) == i + 1)
+    assert limiter.position("A") == 0 and limiter.position("B") == 1 and limiter.position("C") is None
+    for n in range(1, 7):
+        limiter.release()
+        wait_for(lambda: len(admitted) == n)
+    for thread in threads:
+        thread.join()
+    assert admitted == list("ABABAA")
+    assert limiter.active == 1 and not limiter._queues
+
+
+def test_fair_limiter_queue_timeout():
+    limiter = app.FairLimiter(1)
+    limiter.acquire("A")
+    start = time.monotonic()
+    with pytest.raises(requests.Timeout, match="Timed out waiting for a free backend slot"):
+        limiter.acquire("B", timeout=0.2)
+    assert 0.2 <= time.monotonic() - start < 2
+    # The timed-out waiter left the queue, so the slot goes to the next one
+    assert limiter.position("B") is None and not limiter._queues
+    limiter.release()
+    limiter.acquire("B", timeout=0)
+    assert limiter.active == 1
+
+
+def test_identical_concurrent_gets_share_one_request(backend, monkeypatch):
+    monkeypatch.setattr(stub_backend.StubHandler, "latency", 0.5)
+    client = app.BackendClient(f"http://127.0.0.1:{backend.server_address[1]}")
+    stub_backend.reset_stats()
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        responses = list(pool.map(
+            lambda _: client.get("/list_uploaded_files", token=stub_backend.STUB_TOKEN), range(8)
+        ))
+    assert stub_backend.reset_stats()["GET /list_uploaded_files"]["requests"] == 1
+    assert all(resp is responses[0] for resp in responses)
+    assert responses[0].status_code == 200
+    # Once the first request is done, the next one goes to the backend again
+    client.get("/list_uploaded_files", token=stub_backend.STUB_TOKEN)
+    assert stub_backend.reset_stats()["GET /list_uploaded_files"]["requests"] == 1
+
+
+def test_different_gets_are_not_coalesced(backend):
+    client = app.BackendClient(f"http://127.0.0.1:{backend.server_address[1]}")
+    stub_backend.reset_stats()
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        list(pool.map(lambda token: client.get("/list_uploaded_files", token=token),
+                      [stub_backend.STUB_TOKEN, "other"]))
+    assert stub_backend.reset_stats()["GET /list_uploaded_files"]["requests"] == 2
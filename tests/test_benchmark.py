@@ -0,0 +1,70 @@
+import copy
+
+from benchmark import compare
+
+BASELINE = {
+    "scenarios": {
+        "conversation_length": [
+            {"turns": 0, "first_run_seconds": 0.5, "idle_rerun_p50_seconds": 0.06,
+             "idle_requests_per_rerun": 1.0, "idle_response_bytes_per_rerun": 300.0,
+             "ask_seconds": 2.0, "ask_requests": 3, "ask_request_bytes": 700,
+             "ask_response_bytes": 3000, "rss_mb": 150.0},
+            {"turns": 50, "first_run_seconds": 0.3, "idle_rerun_p50_seconds": 0.08,
+             "idle_requests_per_rerun": 1.0, "idle_response_bytes_per_rerun": 300.0,
+             "ask_seconds": 1.6, "ask_requests": 3, "ask_request_bytes": 900,
+             "ask_response_bytes": 3000, "rss_mb": 155.0},
+        ],
+        "concurrent_sessions": [
+            {"sessions": 4, "wall_seconds": 0.9, "ask_p50_seconds": 0.87, "ask_p95_seconds": 0.9,
+             "requests_per_session": 2.0, "request_bytes_per_session": 715.0,
+             "response_bytes_per_session": 3194.0, "rss_mb": 149.0},
+        ],
+    }
+}
+
+
+def test_identical_runs_have_no_regressions():
+    assert compare(BASELINE, copy.deepcopy(BASELINE), 0.2) == []
+
+
+def test_per_rerun_and_per_session_metrics_are_compared():
+    current = copy.deepcopy(BASELINE)
+    current["scenarios"]["conversation_length"][1]["idle_requests_per_rerun"] = 10.0
+    current["scenarios"]["conversation_length"][1]["idle_response_bytes_per_rerun"] = 30000.0
+    current["scenarios"]["concurrent_sessions"][0]["requests_per_session"] = 20.0
+    current["scenarios"]["concurrent_sessions"][0]["request_bytes_per_session"] = 71500.0
+    current["scenarios"]["concurrent_sessions"][0]["response_bytes_per_session"] = 319400.0
+    regressions = compare(BASELINE, current, 0.2)
+    assert len(regressions) == 5
+    assert any(line.startswith("conversation_length[turns=50] idle_requests_per_rerun: 1.0 -> 10.0")
+               for line in regressions)
+    assert any(line.startswith("concurrent_sessions[sessions=4] response_bytes_per_session")
+               for line in regressions)
+
+
+def test_changes_within_tolerance_or_improvements_are_not_regressions():
+    current = copy.deepcopy(BASELINE)
+    row = current["scenarios"]["conversation_length"][0]
+    row["first_run_seconds"] = 0.59      # +18%
+    row["ask_requests"] = 1              # fewer requests
+    row["ask_response_bytes"] = 1500
+    assert compare(BASELINE, current, 0.2) == []
+    row["first_run_seconds"] = 0.61      # +22%
+    assert compare(BASELINE, current, 0.2) == [
+        "conversation_length[turns=0] first_run_seconds: 0.5 -> 0.61 (+22%)"
+    ]
+
+
+def test_rows_and_metrics_missing_from_the_baseline_are_skipped():
+    current = copy.deepcopy(BASELINE)
+    current["scenarios"]["conversation_length"].append(
+        {"turns": 200, "first_run_seconds": 9.0, "idle_requests_per_rerun": 9.0}
+    )
+    current["scenarios"]["concurrent_sessions"][0]["new_bytes_metric"] = 1e9
+    assert compare(BASELINE, current, 0.2) == []
+
+
+def test_rows_are_matched_on_their_parameter():
+    current = copy.deepcopy(BASELINE)
+    current["scenarios"]["conversation_length"].reverse()
+    assert compare(BASELINE, current, 0.0) == []
@@ -0,0 +1,34 @@
+import threading
+
+import app
+
+def test_concurrent_appends_get_distinct_seqs(tmp_path):
+    store = app.ConversationStore(str(tmp_path / "conversations.sqlite"))
+    seqs = []
+    lock = threading.Lock()
+
+    def tab(name):
+        for i in range(20):
+            seq = store.append("user:alice", {"user_message": f"{name} {i}", "agent_replies": []})
+            with lock:
+                seqs.append(seq)
+
+    threads = [threading.Thread(target=tab, args=(f"tab{n}",)) for n in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(seqs) == list(range(80))
+    assert store.count("user:alice") == 80
+
+def test_update_only_changes_its_own_turn(tmp_path):
+    store = app.ConversationStore(str(tmp_path / "conversations.sqlite"))
+    first = store.append("user:alice", {"user_message": "first", "agent_replies": []})
+    second = store.append("user:alice", {"user_message": "second", "agent_replies": []})
+    store.update("user:alice", first, {"user_message": "first", "agent_replies": [{"agent": "A"}]})
+    assert store.load("user:alice", 0, 2) == [
+        {"user_message": "first", "agent_replies": [{"agent": "A"}]},
+        {"user_message": "second", "agent_replies": []},
+    ]
+    assert (first, second) == (0, 1)
+    assert store.import_turns("user:alice", [{"user_message": "imported", "agent_replies": []}]) == 2
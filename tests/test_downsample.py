@@ -0,0 +1,102 @@
+import math
+
+import numpy as np
+import pytest
+
+import app
+
+
+def reference_lttb(points, threshold):
+    """Largest-triangle-three-buckets as published by Steinarsson, on (x, y) tuples."""
+    n = len(points)
+    every = (n - 2) / (threshold - 2)
+    a = 0
+    sampled = [0]
+    for i in range(threshold - 2):
+        avg_start = int(math.floor((i + 1) * every)) + 1
+        avg_end = min(int(math.floor((i + 2) * every)) + 1, n)
+        if avg_end > avg_start:
+            avg_x = sum(points[j][0] for j in range(avg_start, avg_end)) / (avg_end - avg_start)
+            avg_y = sum(points[j][1] for j in range(avg_start, avg_end)) / (avg_end - avg_start)
+        else:
+            avg_x, avg_y = points[n - 1]
+        best_area, best = -1, None
+        for j in range(int(math.floor(i * every)) + 1, int(math.floor((i + 1) * every)) + 1):
+            area = abs((points[a][0] - avg_x) * (points[j][1] - points[a][1])
+                       - (points[a][0] - points[j][0]) * (avg_y - points[a][1]))
+            if area > best_area:
+                best_area, best = area, j
+        sampled.append(best)
+        a = best
+    sampled.append(n - 1)
+    return sampled
+
+
+@pytest.mark.parametrize("n, n_out", [(50, 7), (1000, 100), (10007, 333), (2001, 2000)])
+def test_lttb_matches_reference(n, n_out):
+    rng = np.random.default_rng(n)
+    x = np.sort(rng.uniform(0, 100, size=n))
+    y = np.cumsum(rng.normal(size=n))
+    assert app.lttb_indices(x, y, n_out).tolist() == reference_lttb(list(zip(x, y)), n_out)
+
+
+@pytest.mark.parametrize("n, n_out", [(10, 3), (10, 4), (1000, 100), (1001, 101), (5000, 7)])
+def test_minmax_stays_within_budget_and_keeps_extremes(n, n_out):
+    y = np.random.default_rng(n).normal(size=n)
+    kept = app.minmax_indices(y, n_out)
+    assert len(kept) <= n_out
+    assert kept[0] == 0 and kept[-1] == n - 1
+    assert np.all(np.diff(kept) > 0)
+    if n_out >= 4:
+        assert np.argmin(y) in kept and np.argmax(y) in kept
+
+
+def test_short_series_are_kept_whole():
+    y = np.arange(5.0)
+    assert app.lttb_indices(y, y, 5).tolist() == [0, 1, 2, 3, 4]
+    assert app.minmax_indices(y, 8).tolist() == [0, 1, 2, 3, 4]
+
+
+def line_spec(values, **encoding):
+    return {
+        "mark": {"type": "line"},
+        "data": {"values": values},
+        "encoding": {"x": {"field": "x"}, "y": {"field": "y"}, **encoding},
+    }
+
+
+@pytest.mark.parametrize("method", ["lttb", "minmax"])
+def test_each_series_gets_its_share_of_the_budget(method):
+    rng = np.random.default_rng(0)
+    values = [{"x": i, "y": float(v), "s": s}
+              for s, n in (("a", 3000), ("b", 1000), ("c", 20))
+              for i, v in enumerate(np.cumsum(rng.normal(size=n)))]
+    spec = line_spec(values, color={"field": "s"})
+    out = app.downsample_spec(spec, max_points=300, method=method)
+    rows = out["data"]["values"]
+    per_series = {s: [r for r in rows if r["s"] == s] for s in "abc"}
+    assert len(rows) <= 300
+    assert 90 <= len(per_series["a"]) <= 100
+    assert 90 <= len(per_series["b"]) <= 100
+    assert per_series["c"] == [v for v in values if v["s"] == "c"]
+    for s in "ab":
+        original = [v for v in values if v["s"] == s]
+        assert per_series[s][0] == original[0] and per_series[s][-1] == original[-1]
+    assert spec["data"]["values"] is values and len(values) == 4020
+
+
+def test_dates_on_the_x_axis_are_downsampled():
+    values = [{"x": f"2024-01-01T00:{i // 60:02d}:{i % 60:02d}", "y": i % 17} for i in range(3600)]
+    out = app.downsample_spec(line_spec(values), max_points=500)
+    assert len(out["data"]["values"]) == 500
+    assert out["data"]["values"][0] == values[0] and out["data"]["values"][-1] == values[-1]
+
+
+@pytest.mark.parametrize("spec", [
+    line_spec([{"x": i, "y": f"level {i}"} for i in range(5000)]),
+    {**line_spec([{"x": i, "y": i} for i in range(5000)]), "mark": "bar"},
+    line_spec([{"x": i, "y": i} for i in range(100)]),
+    {"mark": "line", "data": {"url": "data.csv"}, "encoding": {"x": {"field": "x"}, "y": {"field": "y"}}},
+])
+def test_other_specs_are_returned_unchanged(spec):
+    assert app.downsample_spec(spec, max_points=200) is spec
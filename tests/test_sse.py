@@ -0,0 +1,27 @@
+import io
+import json
+
+import requests
+
+import app
+
+
+def sse_response(body):
+    """A text/event-stream response without a charset, as the HTTP adapter builds it."""
+    resp = requests.Response()
+    resp.status_code = 200
+    resp.headers["Content-Type"] = "text/event-stream"
+    resp.encoding = requests.utils.get_encoding_from_headers(resp.headers)
+    resp.raw = io.BytesIO(body)
+    return resp
+
+
+def test_non_ascii_events_are_decoded_as_utf8():
+    events = [{"delta": "Año fiscal: 12 300 €"}, {"delta": "日本語 ✓"}]
+    body = "".join(f"data: {json.dumps(e, ensure_ascii=False)}\n\n" for e in events) + "data: [DONE]\n\n"
+    assert list(app.iter_sse_events(sse_response(body.encode("utf-8")))) == events
+
+
+def test_multiline_data_comments_and_done():
+    body = b": keep-alive\n\ndata: {\"a\":\ndata: 1}\n\ndata: [DONE]\n\ndata: {\"b\": 2}\n\n"
+    assert list(app.iter_sse_events(sse_response(body))) == [{"a": 1}]
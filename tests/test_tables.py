@@ -0,0 +1,66 @@
+import app
+
+def test_prose_with_comma_numbers_stays_text():
+    text = "Revenue by region:\n" + "\n".join(
+        f"- {region}: {n},234,567 units, up {n}% on last year"
+        for n, region in enumerate(["North", "South", "East", "West", "Central", "Islands"], 1)
+    )
+    assert app.split_table_blocks(text) == [("text", text)]
+
+def test_markdown_pipe_table():
+    text = "Sheet extract:\n\n| Region | Note | Revenue |\n|---|---|---:|\n| North | a \\| b | 1,000.50 |\n| South | | 2 |\n\nDone."
+    blocks = app.split_table_blocks(text)
+    assert blocks == [
+        ("text", "Sheet extract:\n"),
+        ("table", 'Region,Note,Revenue\r\nNorth,a | b,"1,000.50"\r\nSouth,,2\r\n', ","),
+        ("text", "\nDone."),
+    ]
+
+def test_pipe_table_rows_are_padded_and_truncated_to_the_header():
+    text = "| a | b |\n|---|---|\n| 1 |\n| 2 | 3 | 4 |"
+    (block,) = app.split_table_blocks(text)
+    assert block == ("table", "a,b\r\n1,\r\n2,3\r\n", ",")
+
+def test_csv_and_tsv_fences():
+    text = "```csv\na,b\n1,2\n```\nbetween\n```TSV\na\tb\n1\t2\n```"
+    assert app.split_table_blocks(text) == [
+        ("table", "a,b\n1,2", ","),
+        ("text", "between"),
+        ("table", "a\tb\n1\t2", "\t"),
+    ]
+
+def test_unterminated_fence_is_prose():
+    text = "```csv\na,b\n1,2"
+    assert app.split_table_blocks(text) == [("text", text)]
+
+def test_tab_runs_need_table_min_rows_of_equal_width():
+    rows = [f"r{i}\t{i}\t{i * 2}" for i in range(app.TABLE_MIN_ROWS)]
+    assert app.split_table_blocks("\n".join(["intro"] + rows)) == [
+        ("text", "intro"),
+        ("table", "\n".join(rows), "\t"),
+    ]
+    short = "\n".join(rows[:app.TABLE_MIN_ROWS - 1])
+    assert app.split_table_blocks(short) == [("text", short)]
+    ragged = "\n".join(rows[:2] + ["x\ty"] + rows[2:])
+    assert app.split_table_blocks(ragged) == [("text", ragged)]
+
+def test_parse_table_uses_arrow_dtypes():
+    frame = app.parse_table("Region, Revenue, Units\nNorth, 1000.5, 10\nSouth, 2000.25, 20\n", ",")
+    assert list(frame.columns) == ["Region", "Revenue", "Units"]
+    assert all(str(dtype).endswith("[pyarrow]") for dtype in frame.dtypes)
+    assert frame["Revenue"].sum() == 3000.75
+    assert frame["Units"].tolist() == [10, 20]
+
+def test_parse_table_tab_separated():
+    frame = app.parse_table("a\tb\n1\tx y\n2\tz\n", "\t")
+    assert frame.shape == (2, 2)
+    assert frame["b"].tolist() == ["x y", "z"]
+
+def test_parse_table_rejects_single_column_and_ragged_blocks():
+    assert app.parse_table("only\n1\n2\n", ",") is None
+    assert app.parse_table("a,b\n1,2\n3,4,5,6\n", ",") is None
+    assert app.parse_table("", ",") is None
+
+def test_parse_reply_shows_unparseable_blocks_as_written():
+    segments = app.parse_reply("Before\n```csv\nonly\n1\n```\nAfter")
+    assert segments == [("text", "Before\n```\nonly\n1\n```\nAfter")]